@@ -1,8 +1,10 @@
 from django.contrib import admin
-from .models import Segment, Brand, Vehicle
+from .models import Segment, Brand, Vehicle, ArchivedVehicle, Job
 
 # Register your models here.
 admin.site.register(Segment)
 admin.site.register(Brand)
 admin.site.register(Vehicle)
+admin.site.register(ArchivedVehicle)
+admin.site.register(Job)
 
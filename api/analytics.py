@@ -0,0 +1,174 @@
+import math
+from array import array
+
+from django.core.cache import cache
+
+from .cache import table_version
+from .models import Vehicle
+
+#numpyはオプション。入っていなければ純粋なpythonで同じ計算をする
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover
+    np = None
+
+CHUNK_SIZE = 50000
+#集計結果をキャッシュしておく秒数
+#バージョンが変われば使われなくなるが、キャッシュの共有がうまくいっていない場合でも古い結果が残り続けないようにする
+STATS_CACHE_SECONDS = 3600
+QUANTILES = (0.1, 0.25, 0.5, 0.75, 0.9)
+GROUPS = (('by_release_year', 'release_year'), ('by_brand', 'brand_id'), ('by_segment', 'segment_id'))
+
+
+#vehicleのprice、release_year、brand_id、segment_idを列ごとの配列として取得する
+#modelのインスタンスやDecimalを作らないよう、values_listでセント単位の整数のまま読み、配列にしてから100で割る
+#idでのキーセットでchunk_size件ずつ取るので、巨大なテーブルでもメモリに全行のタプルを持たない
+def fetch_columns(chunk_size=CHUNK_SIZE, use_numpy=None):
+    use_numpy = np is not None if use_numpy is None else use_numpy
+    chunks = {'price': [], 'release_year': [], 'brand_id': [], 'segment_id': []}
+    last_id = 0
+    while True:
+        rows = list(
+            Vehicle.objects.filter(id__gt=last_id).order_by('id')
+            .values_list('id', 'price_cents', 'release_year', 'brand_id', 'segment_id')[:chunk_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        ids, prices, years, brands, segments = zip(*rows)
+        if use_numpy:
+            chunks['price'].append(np.array(prices, dtype=np.float64) / 100)
+            chunks['release_year'].append(np.array(years, dtype=np.int64))
+            chunks['brand_id'].append(np.array(brands, dtype=np.int64))
+            chunks['segment_id'].append(np.array(segments, dtype=np.int64))
+        else:
+            chunks['price'].append(array('d', [price / 100 for price in prices]))
+            chunks['release_year'].append(array('q', years))
+            chunks['brand_id'].append(array('q', brands))
+            chunks['segment_id'].append(array('q', segments))
+    columns = {}
+    for name, parts in chunks.items():
+        if use_numpy:
+            columns[name] = np.concatenate(parts) if parts else np.array([], dtype=np.float64)
+        else:
+            columns[name] = array('d' if name == 'price' else 'q')
+            for part in parts:
+                columns[name].extend(part)
+    return columns
+
+
+def _round(value):
+    return None if value is None else round(float(value), 2)
+
+
+#ソート済みの値に対する線形補間の分位点(numpy.quantileのデフォルトと同じ)
+def _quantile(sorted_values, q):
+    pos = q * (len(sorted_values) - 1)
+    lo = math.floor(pos)
+    hi = math.ceil(pos)
+    return sorted_values[lo] + (sorted_values[hi] - sorted_values[lo]) * (pos - lo)
+
+
+def _empty_stats():
+    return {
+        'count': 0,
+        'price': {'min': None, 'max': None, 'mean': None, 'quantiles': {}},
+        'by_release_year': [],
+        'by_brand': [],
+        'by_segment': [],
+    }
+
+
+def _group_rows(key_name, keys, counts, sums, mins, maxs, medians):
+    return [
+        {
+            key_name: int(key),
+            'count': int(count),
+            'mean': _round(total / count),
+            'median': _round(median),
+            'min': _round(low),
+            'max': _round(high),
+        }
+        for key, count, total, low, high, median in zip(keys, counts, sums, mins, maxs, medians)
+    ]
+
+
+def _numpy_stats(columns):
+    prices = columns['price']
+    stats = _empty_stats()
+    stats['count'] = int(prices.size)
+    if not prices.size:
+        return stats
+    stats['price'] = {
+        'min': _round(prices.min()),
+        'max': _round(prices.max()),
+        'mean': _round(prices.mean()),
+        'quantiles': {
+            'p%d' % round(q * 100): _round(value)
+            for q, value in zip(QUANTILES, np.quantile(prices, QUANTILES))
+        },
+    }
+    for group_name, key_name in GROUPS:
+        #キー、価格の順に並べ替え、グループの境界を求めて全グループをまとめて集計する
+        order = np.lexsort((prices, columns[key_name]))
+        keys = columns[key_name][order]
+        values = prices[order]
+        bounds = np.flatnonzero(np.diff(keys)) + 1
+        starts = np.concatenate(([0], bounds))
+        ends = np.concatenate((bounds, [keys.size]))
+        counts = ends - starts
+        #グループ内はソート済みなので、中央値は真ん中の2つの平均
+        medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+        stats[group_name] = _group_rows(
+            key_name.replace('_id', ''), keys[starts], counts,
+            np.add.reduceat(values, starts), values[starts], values[ends - 1], medians,
+        )
+    return stats
+
+
+def _python_stats(columns):
+    prices = columns['price']
+    stats = _empty_stats()
+    stats['count'] = len(prices)
+    if not prices:
+        return stats
+    ordered = sorted(prices)
+    stats['price'] = {
+        'min': _round(ordered[0]),
+        'max': _round(ordered[-1]),
+        'mean': _round(math.fsum(ordered) / len(ordered)),
+        'quantiles': {'p%d' % round(q * 100): _round(_quantile(ordered, q)) for q in QUANTILES},
+    }
+    for group_name, key_name in GROUPS:
+        groups = {}
+        for key, price in zip(columns[key_name], prices):
+            groups.setdefault(key, []).append(price)
+        keys = sorted(groups)
+        values = [sorted(groups[key]) for key in keys]
+        stats[group_name] = _group_rows(
+            key_name.replace('_id', ''), keys, [len(v) for v in values],
+            [math.fsum(v) for v in values], [v[0] for v in values], [v[-1] for v in values],
+            [_quantile(v, 0.5) for v in values],
+        )
+    return stats
+
+
+def compute_price_stats(columns, use_numpy=None):
+    use_numpy = np is not None if use_numpy is None else use_numpy
+    if use_numpy:
+        return _numpy_stats(columns)
+    return _python_stats(columns)
+
+
+#集計結果はvehicleテーブルのバージョンをキーにしてキャッシュする
+#vehicleが追加・更新・削除されるとバージョンが変わるので、次のアクセスで計算し直される
+#バージョンと結果は全プロセスで共有するキャッシュにあるので、workerのrebuild_statsの結果もAPIから返る
+def get_price_stats(use_cache=True):
+    key = 'vehicle_price_stats:%s' % table_version(Vehicle)
+    if use_cache:
+        stats = cache.get(key)
+        if stats is not None:
+            return stats
+    stats = compute_price_stats(fetch_columns())
+    cache.set(key, stats, STATS_CACHE_SECONDS)
+    return stats
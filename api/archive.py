@@ -0,0 +1,27 @@
+from django.db import transaction
+
+from .cache import bump_table_version
+from .models import ArchivedVehicle, Vehicle
+
+#ArchivedVehicleにコピーするフィールド
+ARCHIVED_FIELDS = ('id', 'user_id', 'vehicle_name', 'release_year', 'price_cents', 'segment_id', 'brand_id')
+
+
+#release_yearがcutoff_yearより前のvehicleを、最大batch_size件だけArchivedVehicleへ移す
+#コピーと削除を1つのtransactionで行うので、途中で止まっても行が消えたり二重になったりしない
+#移した件数を返す(0なら移すものはもう残っていない)
+def archive_batch(cutoff_year, batch_size):
+    with transaction.atomic():
+        rows = list(
+            Vehicle.objects.filter(release_year__lt=cutoff_year)
+            .order_by('id').select_for_update().values(*ARCHIVED_FIELDS)[:batch_size]
+        )
+        if not rows:
+            return 0
+        #同じidがすでにアーカイブにあればIntegrityErrorになり、バッチ全体がrollbackされる
+        #(無視すると、コピーされていないvehicleまで削除してしまう)
+        ArchivedVehicle.objects.bulk_create([ArchivedVehicle(**row) for row in rows])
+        Vehicle.objects.filter(id__in=[row['id'] for row in rows]).delete()
+    #bulk_createではsignalsが飛ばないので、キャッシュ用のバージョンはここで上げる
+    bump_table_version(ArchivedVehicle)
+    return len(rows)
@@ -0,0 +1,122 @@
+import logging
+import traceback
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection, connections
+from django.test.utils import CaptureQueriesContext
+
+logger = logging.getLogger(__name__)
+
+#viewsetではないview(genericsなど)でのHTTPメソッドとactionの対応
+#ProfileUserViewのGETは'retrieve'として扱う
+METHOD_ACTIONS = {
+    'get': ('retrieve', 'list'),
+    'post': ('create',),
+    'put': ('update',),
+    'patch': ('partial_update',),
+    'delete': ('destroy',),
+}
+
+
+class QueryBudgetExceeded(Exception):
+
+    def __init__(self, view_name, budget, queries):
+        self.view_name = view_name
+        self.budget = budget
+        #queriesは(sql, stack)のリスト。stackは予算を超えたクエリにだけ付く
+        self.queries = queries
+        super().__init__('%s ran %d queries (budget %d)' % (view_name, len(queries), budget))
+
+
+#viewのquery_budgetsから、actionに対応するクエリ数の上限を返す(宣言がなければNone)
+def get_budget(view_cls, action):
+    return getattr(view_cls, 'query_budgets', {}).get(action)
+
+
+def resolve_action(view_func, method):
+    method = method.lower()
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        return actions.get(method)
+    view_cls = view_func.cls
+    for action in METHOD_ACTIONS.get(method, ()):
+        if hasattr(view_cls, action):
+            return action
+    return method
+
+
+def format_queries(queries):
+    lines = []
+    for i, (sql, stack) in enumerate(queries, 1):
+        lines.append('%d: %s' % (i, sql))
+        if stack:
+            lines.append(''.join(stack))
+    return '\n'.join(lines)
+
+
+#リクエストごとのクエリ数を数え、viewが宣言した予算を超えたらログを出す(またはエラーにする)
+#QUERY_BUDGET_MODEが'log'か'raise'のときだけ有効になる
+class QueryBudgetMiddleware:
+
+    def __init__(self, get_response):
+        self.mode = getattr(settings, 'QUERY_BUDGET_MODE', None)
+        if self.mode not in ('log', 'raise'):
+            #無効のときはmiddlewareのチェーンから外れるので、オーバーヘッドはない
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        view_cls = getattr(view_func, 'cls', None)
+        if view_cls is None:
+            return None
+        action = resolve_action(view_func, request.method)
+        budget = get_budget(view_cls, action)
+        if budget is not None:
+            request._query_budget = ('%s.%s' % (view_cls.__name__, action), budget)
+        return None
+
+    def __call__(self, request):
+        queries = []
+
+        def record(execute, sql, params, many, context):
+            budget = getattr(request, '_query_budget', None)
+            stack = None
+            if budget is not None and len(queries) >= budget[1]:
+                #予算を超えたクエリだけ、どこから呼ばれたかを残す
+                stack = traceback.format_stack()[:-1]
+            queries.append((sql, stack))
+            return execute(sql, params, many, context)
+
+        with ExitStack() as stack:
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(record))
+            response = self.get_response(request)
+
+        budget = getattr(request, '_query_budget', None)
+        if budget is not None and len(queries) > budget[1]:
+            error = QueryBudgetExceeded(budget[0], budget[1], queries)
+            if self.mode == 'raise':
+                raise error
+            logger.warning('%s\n%s', error, format_queries(queries))
+        return response
+
+
+#テスト用: データ件数を変えながら、リクエストのクエリ数が予算内に収まっているかを確認する
+#件数によってクエリ数が増える(N+1)と、大きいサイズで予算を超えて失敗する
+class QueryBudgetTestMixin:
+
+    def assertWithinQueryBudget(self, view_cls, action, request, populate, sizes=(1, 10, 50)):
+        budget = get_budget(view_cls, action)
+        self.assertIsNotNone(budget, '%s.%s has no query budget' % (view_cls.__name__, action))
+        for size in sizes:
+            populate(size)
+            with CaptureQueriesContext(connection) as ctx:
+                request()
+            queries = [(query['sql'], None) for query in ctx.captured_queries]
+            self.assertLessEqual(
+                len(queries), budget,
+                '%s.%s ran %d queries with %d rows (budget %d)\n%s' % (
+                    view_cls.__name__, action, len(queries), size, budget, format_queries(queries)),
+            )
@@ -0,0 +1,95 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+#テーブルごとのバージョン番号
+#signalsでmodelが保存・削除されるたびに+1され、これをキーに含めたキャッシュは自動的に古いものとして扱われる
+#django.core.cacheに置いているので、ほかのプロセスでの変更による無効化も伝わる(settings.pyのCACHESは全プロセスで共有するもの)
+def _version_key(model):
+    return 'table_version:%s' % model._meta.label_lower
+
+
+#キーがキャッシュから消えたときに1からやり直すと、以前のバージョンで読み込んだプロセス内のキャッシュが
+#新しいものとして使われてしまうので、初期値は現在時刻(ナノ秒)にする
+def _initial_version():
+    return time.time_ns()
+
+
+def table_version(model):
+    return cache.get_or_set(_version_key(model), _initial_version, None)
+
+
+def _incr_table_version(model):
+    key = _version_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        #キーがまだない(またはキャッシュから消えた)場合
+        cache.set(key, _initial_version(), None)
+
+
+#commitされてからバージョンを上げる(transaction外ならすぐに上がる)
+#commit前に上げると、ほかのworkerが変更前の行を新しいバージョンで読み込んでしまい、commit後も古いまま残る
+#rollbackされた場合はバージョンを上げない
+def bump_table_version(model):
+    transaction.on_commit(lambda: _incr_table_version(model))
+
+
+#segment、brandのような小さいテーブルの行をプロセス内に丸ごと持っておくキャッシュ
+#FKのバリデーションで毎回SELECTしないようにするために使う
+class ReferenceCache:
+
+    def __init__(self, model):
+        self.model = model
+        self._lock = threading.Lock()
+        self._version = None
+        self._objects = {}
+
+    def _current(self, in_transaction):
+        version = table_version(self.model)
+        if version != self._version:
+            if in_transaction:
+                #transactionの中で読んだ行はrollbackされるかもしれないので、キャッシュには入れない
+                return None
+            with self._lock:
+                if version != self._version:
+                    #テーブルが小さいので、変更があったら全件を1クエリで読み直す
+                    self._objects = {obj.pk: obj for obj in self.model.objects.all()}
+                    self._version = version
+        return self._objects
+
+    def get(self, pk):
+        return self.get_many([pk]).get(pk)
+
+    #{pk: obj}を返す(存在しないpkは含まれない)
+    #バージョンの確認は1回だけで、キャッシュにないpkはまとめて1クエリで確認する
+    def get_many(self, pks):
+        in_transaction = transaction.get_connection().in_atomic_block
+        objects = self._current(in_transaction)
+        if objects is None:
+            objects = {}
+        found = {}
+        missing = set()
+        for pk in pks:
+            if pk in objects:
+                found[pk] = objects[pk]
+            else:
+                missing.add(pk)
+        if missing:
+            #別プロセスで追加された直後の行かもしれないので、見つからないときだけDBを確認する
+            fetched = {obj.pk: obj for obj in self.model.objects.filter(pk__in=missing)}
+            found.update(fetched)
+            if not in_transaction and objects is self._objects:
+                objects.update(fetched)
+        return found
+
+    #ほかのプロセスで削除された直後など、キャッシュにある行がDBにないと分かったときに消す
+    def evict(self, pk):
+        self._objects.pop(pk, None)
+
+    #serializerのfieldはdeepcopyされるが、キャッシュはプロセス内で共有したいのでコピーしない
+    def __deepcopy__(self, memo):
+        return self
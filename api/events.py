@@ -0,0 +1,177 @@
+import asyncio
+import json
+import threading
+from collections import deque
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from rest_framework.authtoken.models import Token
+
+DEFAULTS = {
+    #クライアントごとに溜めておける未送信イベントの数。超えたら接続を切り、Last-Event-IDで再接続してもらう
+    'BUFFER_SIZE': 100,
+    #Last-Event-IDでの再開用に覚えておく直近のイベント数
+    'HISTORY_SIZE': 1000,
+    #何もイベントがないときに接続維持のコメントを送る間隔(秒)
+    'HEARTBEAT_SECONDS': 15,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'EVENT_STREAM', {}).get(name, DEFAULTS[name])
+
+
+class Subscriber:
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queue = asyncio.Queue(maxsize=get_setting('BUFFER_SIZE'))
+        self.overflowed = False
+
+    def deliver(self, event):
+        #イベントループのスレッドで呼ばれる
+        if self.overflowed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.overflowed = True
+
+
+#プロセス内のpub/sub
+#publishはsignalsから(viewを実行しているスレッドで)呼ばれ、各クライアントのイベントループに渡される
+class EventBroker:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=get_setting('HISTORY_SIZE'))
+        self._last_id = 0
+
+    def publish(self, model, action, pk):
+        with self._lock:
+            self._last_id += 1
+            event = {'id': self._last_id, 'model': model, 'action': action, 'pk': pk}
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            subscriber.loop.call_soon_threadsafe(subscriber.deliver, event)
+
+    def subscribe(self, last_event_id=None):
+        subscriber = Subscriber(asyncio.get_running_loop())
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if last_event_id is not None:
+                missed = [event for event in self._history if event['id'] > last_event_id]
+                #履歴に残っていない(またはプロセスが再起動した)場合は、一覧を取り直すようにresetを送る
+                #バッファに入りきらない場合も、送りきれずに再接続を繰り返すことになるのでresetにする
+                oldest = missed[0]['id'] if missed else self._last_id + 1
+                if oldest != last_event_id + 1 or len(missed) > get_setting('BUFFER_SIZE'):
+                    subscriber.deliver({'id': self._last_id, 'model': None, 'action': 'reset', 'pk': None})
+                else:
+                    for event in missed:
+                        subscriber.deliver(event)
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+
+broker = EventBroker()
+
+
+def format_event(event):
+    if event['action'] == 'reset':
+        name = 'reset'
+    else:
+        name = '%s.%s' % (event['model'], event['action'])
+    data = json.dumps({'model': event['model'], 'action': event['action'], 'id': event['pk']})
+    return ('id: %d\nevent: %s\ndata: %s\n\n' % (event['id'], name, data)).encode()
+
+
+@sync_to_async
+def authenticate(key):
+    try:
+        token = Token.objects.select_related('user').get(key=key)
+    except Token.DoesNotExist:
+        return None
+    return token.user if token.user.is_active else None
+
+
+def _parse_request(scope):
+    headers = {name.decode('latin1').lower(): value.decode('latin1') for name, value in scope['headers']}
+    query = parse_qs(scope.get('query_string', b'').decode('latin1'))
+    #ブラウザのEventSourceはヘッダーを付けられないので、?token=でも受け付ける
+    key = None
+    auth = headers.get('authorization', '').split()
+    if len(auth) == 2 and auth[0].lower() == 'token':
+        key = auth[1]
+    elif 'token' in query:
+        key = query['token'][0]
+    last_event_id = headers.get('last-event-id') or query.get('last_event_id', [None])[0]
+    try:
+        last_event_id = int(last_event_id) if last_event_id is not None else None
+    except ValueError:
+        last_event_id = None
+    return key, last_event_id
+
+
+async def _wait_disconnect(receive):
+    while True:
+        message = await receive()
+        if message['type'] == 'http.disconnect':
+            return
+
+
+async def _send_error(send, status, message):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json')],
+    })
+    await send({'type': 'http.response.body', 'body': json.dumps({'detail': message}).encode()})
+
+
+#vehicle、brand、segmentの作成・更新・削除をServer-Sent Eventsで送るASGIアプリ(/api/events/)
+#1クライアントは1つのasyncioのタスクで待つだけなので、スレッドを使わずに大量のアイドル接続を持てる
+async def event_stream(scope, receive, send):
+    key, last_event_id = _parse_request(scope)
+    user = await authenticate(key) if key else None
+    if user is None:
+        await _send_error(send, 401, 'Authentication credentials were not provided.')
+        return
+    subscriber = broker.subscribe(last_event_id)
+    disconnect = asyncio.ensure_future(_wait_disconnect(receive))
+    try:
+        await send({
+            'type': 'http.response.start',
+            'status': 200,
+            'headers': [
+                (b'content-type', b'text/event-stream'),
+                (b'cache-control', b'no-cache'),
+                (b'x-accel-buffering', b'no'),
+            ],
+        })
+        #バッファがあふれても、溜まっている分は送ってから接続を終える
+        while not (subscriber.overflowed and subscriber.queue.empty()):
+            get = asyncio.ensure_future(subscriber.queue.get())
+            done, _ = await asyncio.wait(
+                {get, disconnect}, timeout=get_setting('HEARTBEAT_SECONDS'),
+                return_when=asyncio.FIRST_COMPLETED,
+            )
+            if get in done:
+                body = format_event(get.result())
+            else:
+                get.cancel()
+                if disconnect in done:
+                    break
+                body = b': keepalive\n\n'
+            await send({'type': 'http.response.body', 'body': body, 'more_body': True})
+        if not disconnect.done():
+            #バッファがあふれた場合は接続を終える。クライアントはLast-Event-IDで再接続する
+            await send({'type': 'http.response.body', 'body': b''})
+    finally:
+        disconnect.cancel()
+        broker.unsubscribe(subscriber)
@@ -0,0 +1,117 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.db import DatabaseError, connection, transaction
+from django.db.models.signals import post_save
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    #WSGIのスレッドで並行にリクエストを処理するworker(gunicorn --threadsなど)でだけ有効にすること
+    'ENABLED': False,
+    #最初の1件が来てから、最大何ミリ秒ほかのリクエストを待つか
+    'MAX_DELAY_MS': 5,
+    #この件数が集まったら待たずに書き込む
+    'MAX_ROWS': 100,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'VEHICLE_GROUP_COMMIT', {}).get(name, DEFAULTS[name])
+
+
+_warned_asgi = False
+
+
+#このリクエストでgroup commitを使うか
+#ASGIではsyncのviewが1つのスレッドで順番に実行されるので、まとめる相手が来ないままMAX_DELAY_MS待つだけになる
+#そのためENABLEDでもASGIのリクエストでは使わない
+def is_enabled(request):
+    global _warned_asgi
+    if not get_setting('ENABLED'):
+        return False
+    if isinstance(request, ASGIRequest):
+        if not _warned_asgi:
+            _warned_asgi = True
+            logger.warning('VEHICLE_GROUP_COMMIT is ignored under ASGI, it only helps threaded WSGI workers')
+        return False
+    return True
+
+
+class _Pending:
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.error = None
+        self.done = threading.Event()
+
+
+#同時に来た1件ずつのINSERTをまとめて、1つのtransaction(1回のcommit)で書き込む
+#最初に来たスレッドがleaderになり、MAX_DELAY_MSかMAX_ROWS件まで待ってから全員分を書き込む
+#ほかのスレッドはleaderの書き込みが終わるのを待ち、それぞれ自分のインスタンス(id付き)かエラーを受け取る
+#スレッドで並行にリクエストを処理するWSGIのworker(gunicorn --threadsなど)で効果がある
+class GroupCommitBuffer:
+
+    def __init__(self, model):
+        self.model = model
+        self._cond = threading.Condition()
+        self._pending = []
+
+    def submit(self, instance):
+        item = _Pending(instance)
+        max_rows = get_setting('MAX_ROWS')
+        with self._cond:
+            self._pending.append(item)
+            leader = len(self._pending) == 1
+            if len(self._pending) >= max_rows:
+                self._cond.notify_all()
+        if leader:
+            with self._cond:
+                self._cond.wait_for(lambda: len(self._pending) >= max_rows, get_setting('MAX_DELAY_MS') / 1000)
+                batch, self._pending = self._pending, []
+            self._flush(batch)
+        else:
+            item.done.wait()
+        if item.error is not None:
+            raise item.error
+        return item.instance
+
+    def _flush(self, batch):
+        try:
+            with transaction.atomic():
+                self._write(batch)
+        except Exception as exc:
+            for item in batch:
+                if item.error is None:
+                    item.error = exc
+        finally:
+            for item in batch:
+                item.done.set()
+
+    def _write(self, batch):
+        try:
+            with transaction.atomic():
+                self._write_all([item.instance for item in batch])
+        except DatabaseError:
+            #どれかの行が失敗したら、1行ずつsavepointで書き直して、失敗した行の呼び出し元にだけエラーを返す
+            for item in batch:
+                item.instance.pk = None
+                item.instance._state.adding = True
+                try:
+                    with transaction.atomic():
+                        item.instance.save()
+                except DatabaseError as exc:
+                    item.error = exc
+
+    def _write_all(self, instances):
+        if connection.features.can_return_rows_from_bulk_insert:
+            self.model.objects.bulk_create(instances)
+            #bulk_createではsignalsが飛ばないので、キャッシュの無効化やイベント配信のためにここで送る
+            for instance in instances:
+                post_save.send(sender=self.model, instance=instance, created=True)
+        else:
+            #bulk_createでidが返らないDB(sqlite)では1行ずつINSERTする。commitは1回なのは同じ
+            for instance in instances:
+                instance.save()
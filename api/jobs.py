@@ -0,0 +1,270 @@
+import csv
+import logging
+import os
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .analytics import get_price_stats
+from .models import Job, Vehicle
+from .serializers import VehicleSerializer, prefetch_references
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'PROCESSES': 2,
+    #キューが空のときに次を確認するまでの秒数
+    'POLL_SECONDS': 1,
+    #実行中のジョブのheartbeatを更新する間隔(秒)。HEARTBEAT_TIMEOUT_SECONDSより十分短くすること
+    'HEARTBEAT_SECONDS': 30,
+    #この秒数heartbeatが更新されていない実行中のジョブは、workerが落ちたとみなす
+    'HEARTBEAT_TIMEOUT_SECONDS': 300,
+    #落ちたジョブをやり直す回数の上限
+    'MAX_ATTEMPTS': 3,
+    'EXPORT_DIR': os.path.join(settings.BASE_DIR, 'exports'),
+    'BATCH_SIZE': 1000,
+}
+
+
+def get_setting(name):
+    return getattr(settings, 'JOBS', {}).get(name, DEFAULTS[name])
+
+
+#ジョブの種類(kind)と処理する関数の対応
+HANDLERS = {}
+
+
+def register(kind):
+    def decorator(func):
+        HANDLERS[kind] = func
+        return func
+    return decorator
+
+
+class JobCancelled(Exception):
+    pass
+
+
+#heartbeatが途絶えたとみなされ、ジョブがキューに戻された(ほかのworkerがやり直している)
+class JobLost(Exception):
+    pass
+
+
+#このworkerが実行している、この回(attempts)のジョブ
+#キューに戻されてほかのworkerがやり直していれば0件になるので、古い実行が進捗や結果を上書きしない
+def _owned(job):
+    return Job.objects.filter(pk=job.pk, status=Job.RUNNING, worker=job.worker, attempts=job.attempts)
+
+
+#進捗とheartbeatを記録する。キャンセルされていたらJobCancelledで処理を止める
+#ジョブの関数はバッチごとにこれを呼ぶこと
+#resultを渡すと途中までの結果も保存する(やり直しのときにjob.resultから続ける場合に使う)
+def report_progress(job, processed, total=None, result=None):
+    fields = {'processed': processed, 'heartbeat_at': timezone.now()}
+    if total is not None:
+        fields['total'] = total
+    if result is not None:
+        fields['result'] = result
+    if not _owned(job).update(**fields):
+        raise JobLost
+    if Job.objects.filter(pk=job.pk, cancel_requested=True).exists():
+        raise JobCancelled
+
+
+#ジョブの関数が進捗を報告しない間(1回の長い集計など)も、別スレッドでheartbeatを更新し続ける
+#プロセスが落ちればこのスレッドも止まるので、heartbeatが途絶えるのはworkerが落ちたときだけになる
+class _Heartbeat(threading.Thread):
+
+    def __init__(self, job):
+        super().__init__(daemon=True)
+        self.job = job
+        self._stopped = threading.Event()
+
+    def run(self):
+        try:
+            while not self._stopped.wait(get_setting('HEARTBEAT_SECONDS')):
+                try:
+                    if not _owned(self.job).update(heartbeat_at=timezone.now()):
+                        return
+                except DatabaseError:
+                    #一時的なエラー(sqliteのロックなど)は次の間隔でやり直す
+                    logger.warning('failed to update heartbeat of job %d', self.job.pk, exc_info=True)
+        finally:
+            #このスレッドのDB接続を閉じる
+            connection.close()
+
+    def stop(self):
+        self._stopped.set()
+        self.join()
+
+
+#キューの一番古いジョブを取り出す
+#status='queued'を条件にしたUPDATEで取り合うので、複数のworkerが同じジョブを実行することはない
+#(実行中は_Heartbeatがheartbeatを更新し続けるので、生きているworkerのジョブがキューに戻されることもない)
+def claim_next_job(worker):
+    for job_id in Job.objects.filter(status=Job.QUEUED).order_by('id').values_list('id', flat=True)[:10]:
+        now = timezone.now()
+        claimed = Job.objects.filter(id=job_id, status=Job.QUEUED).update(
+            status=Job.RUNNING, worker=worker, started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+        )
+        if claimed:
+            return Job.objects.get(id=job_id)
+    return None
+
+
+def _finish(job, status, result=None, error=''):
+    _owned(job).update(status=status, result=result, error=error, finished_at=timezone.now())
+
+
+def run_job(job):
+    handler = HANDLERS.get(job.kind)
+    heartbeat = _Heartbeat(job)
+    heartbeat.start()
+    try:
+        if handler is None:
+            raise ValueError('unknown job kind: %s' % job.kind)
+        if job.cancel_requested:
+            raise JobCancelled
+        result = handler(job, job.params)
+    except JobLost:
+        #やり直しているworkerの結果を上書きしないよう、何も書き込まずに終える
+        logger.warning('job %d was requeued while running on %s, dropping this attempt', job.pk, job.worker)
+    except JobCancelled:
+        _finish(job, Job.CANCELLED)
+    except Exception as exc:
+        #tracebackはジョブを登録したユーザーに返さず、ログにだけ出す
+        logger.exception('job %d (%s) failed', job.pk, job.kind)
+        _finish(job, Job.FAILED, error=str(exc) or exc.__class__.__name__)
+    else:
+        _finish(job, Job.SUCCEEDED, result=result)
+    finally:
+        heartbeat.stop()
+
+
+#heartbeatが途絶えた実行中のジョブを、キューに戻す(やり直し回数を超えていれば失敗にする)
+def recover_stale_jobs():
+    now = timezone.now()
+    cutoff = now - timedelta(seconds=get_setting('HEARTBEAT_TIMEOUT_SECONDS'))
+    stale = Job.objects.filter(status=Job.RUNNING, heartbeat_at__lt=cutoff)
+    stale.filter(cancel_requested=True).update(status=Job.CANCELLED, finished_at=now)
+    stale.filter(attempts__gte=get_setting('MAX_ATTEMPTS')).update(
+        status=Job.FAILED, error='worker stopped responding', finished_at=now)
+    return stale.update(status=Job.QUEUED, worker='')
+
+
+#キュー待ちのジョブはすぐにキャンセルし、実行中のジョブにはキャンセルを依頼する
+def cancel_job(job):
+    now = timezone.now()
+    if not Job.objects.filter(pk=job.pk, status=Job.QUEUED).update(status=Job.CANCELLED, finished_at=now):
+        Job.objects.filter(pk=job.pk, status=Job.RUNNING).update(cancel_requested=True)
+    job.refresh_from_db()
+    return job
+
+
+#workerのループ。burstがTrueならキューが空になったところで終わる
+def work(worker, burst=False):
+    while True:
+        close_old_connections()
+        recover_stale_jobs()
+        job = claim_next_job(worker)
+        if job is None:
+            if burst:
+                return
+            time.sleep(get_setting('POLL_SECONDS'))
+            continue
+        run_job(job)
+
+
+def _batches(queryset, batch_size):
+    #idでのキーセットでbatch_size件ずつ返す
+    last_id = 0
+    while True:
+        batch = list(queryset.filter(id__gt=last_id).order_by('id')[:batch_size])
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
+
+
+#価格の集計をキャッシュを使わずに作り直す
+@register('rebuild_stats')
+def rebuild_stats(job, params):
+    report_progress(job, 0, 1)
+    stats = get_price_stats(use_cache=False)
+    report_progress(job, 1)
+    return stats
+
+
+#エクスポートしたCSVのパス(GET /api/jobs/{id}/download/で返す)
+#workerとAPIが別のホストで動く場合は、EXPORT_DIRを両方から見える共有ストレージにすること
+def export_path(job):
+    return os.path.join(get_setting('EXPORT_DIR'), 'vehicles-%d.csv' % job.id)
+
+
+#vehicleをCSVに書き出す
+@register('export_vehicles')
+def export_vehicles(job, params):
+    os.makedirs(get_setting('EXPORT_DIR'), exist_ok=True)
+    path = export_path(job)
+    queryset = Vehicle.objects.select_related('segment', 'brand')
+    total = queryset.count()
+    report_progress(job, 0, total)
+    fields = VehicleSerializer.Meta.fields
+    processed = 0
+    with open(path, 'w', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        for batch in _batches(queryset, get_setting('BATCH_SIZE')):
+            writer.writerows(VehicleSerializer(batch, many=True).data)
+            processed += len(batch)
+            report_progress(job, processed)
+    return {'rows': processed}
+
+
+#params: {"vehicles": [{"vehicle_name": ..., "release_year": ..., "price": ..., "segment": id, "brand": id}, ...]}
+#ジョブを登録したユーザーのvehicleとして作成し、エラーの行は{行番号: エラー}で返す
+#バッチの作成と進捗・途中結果の記録を1つのtransactionで行うので、workerが落ちてやり直す場合は
+#commitされたバッチの続き(job.processed)から始まり、同じ行が二重に作成されることはない
+@register('import_vehicles')
+def import_vehicles(job, params):
+    rows = params.get('vehicles', [])
+    result = job.result or {'created': 0, 'errors': {}}
+    report_progress(job, job.processed, len(rows))
+    batch_size = get_setting('BATCH_SIZE')
+    for start in range(job.processed, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        #segment、brandはバッチごとにまとめて確認する(transactionの外で読むとキャッシュに入る)
+        context = prefetch_references(batch)
+        with transaction.atomic():
+            for index, row in enumerate(batch, start):
+                serializer = VehicleSerializer(data=row, context=context)
+                if serializer.is_valid():
+                    serializer.save(user=job.user)
+                    result['created'] += 1
+                else:
+                    result['errors'][str(index)] = serializer.errors
+            report_progress(job, start + len(batch), result=result)
+    return result
+
+
+#params: {"release_year_before": 2000}
+#ジョブを登録したユーザーのvehicleのうち、release_yearが指定より前のものをバッチに分けて削除する
+@register('delete_vehicles')
+def delete_vehicles(job, params):
+    queryset = Vehicle.objects.filter(user=job.user, release_year__lt=int(params['release_year_before']))
+    total = queryset.count()
+    report_progress(job, 0, total)
+    deleted = 0
+    while True:
+        ids = list(queryset.order_by('id').values_list('id', flat=True)[:get_setting('BATCH_SIZE')])
+        if not ids:
+            break
+        Vehicle.objects.filter(id__in=ids).delete()
+        deleted += len(ids)
+        report_progress(job, deleted)
+    return {'deleted': deleted}
@@ -0,0 +1,36 @@
+import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import IntegrityError
+
+from api.archive import archive_batch
+
+
+#古いvehicleをapi_archivedvehicleへ少しずつ移す
+#1バッチごとにcommitするので、途中で止めても再実行すれば続きから移せる
+class Command(BaseCommand):
+    help = 'Move vehicles older than the cutoff release_year to the archive table in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cutoff-year', type=int, help='archive vehicles released before this year')
+        parser.add_argument('--batch-size', type=int, default=settings.VEHICLE_ARCHIVE['BATCH_SIZE'])
+        parser.add_argument('--max-batches', type=int, help='stop after this many batches')
+
+    def handle(self, *args, **options):
+        cutoff_year = options['cutoff_year']
+        if cutoff_year is None:
+            cutoff_year = datetime.date.today().year - settings.VEHICLE_ARCHIVE['CUTOFF_YEARS']
+        total = 0
+        batches = 0
+        while options['max_batches'] is None or batches < options['max_batches']:
+            try:
+                moved = archive_batch(cutoff_year, options['batch_size'])
+            except IntegrityError as exc:
+                raise CommandError('a vehicle in the next batch is already archived, nothing was moved: %s' % exc)
+            if not moved:
+                break
+            total += moved
+            batches += 1
+            self.stdout.write('archived %d vehicles (%d total)' % (moved, total))
+        self.stdout.write('done: %d vehicles released before %d archived' % (total, cutoff_year))
@@ -0,0 +1,59 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import override_settings
+
+from api.group_commit import GroupCommitBuffer
+from api.models import Brand, Segment, Vehicle
+
+BENCH_NAME = 'bench_group_commit'
+
+
+#複数スレッドから1件ずつvehicleを作り、1件1commitとgroup commitのスループットを比べる
+#作ったデータは最後に削除する
+class Command(BaseCommand):
+    help = 'Benchmark single-row creates against group commit under concurrency'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=16)
+        parser.add_argument('--rows', type=int, default=2000)
+        parser.add_argument('--max-delay-ms', type=int, default=5)
+        parser.add_argument('--max-rows', type=int, default=100)
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=BENCH_NAME)
+        self.fields = {
+            'user': user,
+            'segment': Segment.objects.create(segment_name=BENCH_NAME),
+            'brand': Brand.objects.create(brand_name=BENCH_NAME),
+            'vehicle_name': BENCH_NAME,
+            'release_year': 2021,
+            'price': 500,
+        }
+        try:
+            buffer = GroupCommitBuffer(Vehicle)
+            group_commit = {'MAX_DELAY_MS': options['max_delay_ms'], 'MAX_ROWS': options['max_rows']}
+            self.run('single commit', lambda: Vehicle.objects.create(**self.fields), options)
+            with override_settings(VEHICLE_GROUP_COMMIT=group_commit):
+                self.run('group commit', lambda: buffer.submit(Vehicle(**self.fields)), options)
+        finally:
+            #vehicleはcascadeで消える
+            user.delete()
+            self.fields['segment'].delete()
+            self.fields['brand'].delete()
+
+    def run(self, label, create, options):
+        def worker(_):
+            try:
+                create()
+            finally:
+                connection.close()
+
+        began = time.perf_counter()
+        with ThreadPoolExecutor(options['threads']) as pool:
+            list(pool.map(worker, range(options['rows'])))
+        elapsed = time.perf_counter() - began
+        self.stdout.write('%-14s %8.0f rows/s' % (label, options['rows'] / elapsed))
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.test import Client, override_settings
+
+
+#fullとapiのmiddleware構成で、/api/へのリクエスト1回あたりの処理時間を比べる
+#DBにアクセスしないよう、認証なしで/api/(401が返る)にアクセスして計測する
+class Command(BaseCommand):
+    help = 'Compare per-request overhead of the full and API middleware profiles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=5000)
+        parser.add_argument('--path', default='/api/')
+
+    def handle(self, *args, **options):
+        profiles = [('full', settings.FULL_MIDDLEWARE), ('api', settings.API_MIDDLEWARE)]
+        results = {}
+        for name, middleware in profiles:
+            with override_settings(MIDDLEWARE=middleware, DEBUG=False, ALLOWED_HOSTS=['testserver']):
+                client = Client()
+                #1回目でmiddlewareのチェーンが作られるので計測から外す
+                client.get(options['path'])
+                began = time.perf_counter()
+                for _ in range(options['requests']):
+                    client.get(options['path'])
+                results[name] = (time.perf_counter() - began) / options['requests'] * 1e6
+            self.stdout.write('%-5s %8.1f us/request' % (name, results[name]))
+        saved = results['full'] - results['api']
+        self.stdout.write('saved %.1f us/request (%.1f%%)' % (saved, saved / results['full'] * 100))
@@ -0,0 +1,57 @@
+import random
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Avg, Sum
+from rest_framework import serializers
+
+from api.models import Brand, Segment, Vehicle
+from api.serializers import CentsPriceField
+
+
+#priceのシリアライズとSUM/AVGの速さを計測する
+#シリアライズは、以前のDecimalFieldでDecimalを文字列にする場合と、セントの整数から直接文字列にする場合を比べる
+#データはtransactionの中で作り、最後にrollbackするのでDBには残らない
+class Command(BaseCommand):
+    help = 'Benchmark price serialization and SUM/AVG on integer-cents storage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=200000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.populate(options['rows'])
+            self.run()
+            transaction.set_rollback(True)
+
+    def populate(self, rows):
+        rng = random.Random(0)
+        user = User.objects.create(username='bench_price')
+        brand = Brand.objects.create(brand_name='bench_price')
+        segment = Segment.objects.create(segment_name='bench_price')
+        Vehicle.objects.bulk_create([
+            Vehicle(user=user, brand=brand, segment=segment, vehicle_name='MODEL S', release_year=2019,
+                    price=round(rng.uniform(1, 9999), 2))
+            for _ in range(rows)
+        ], batch_size=10000)
+
+    def timed(self, label, func, repeat=1):
+        began = time.perf_counter()
+        for _ in range(repeat):
+            result = func()
+        self.stdout.write('%-28s %8.4fs' % (label, (time.perf_counter() - began) / repeat))
+        return result
+
+    def run(self):
+        cents = list(Vehicle.objects.values_list('price_cents', flat=True))
+        decimals = [Vehicle(price_cents=value).price for value in cents]
+        decimal_field = serializers.DecimalField(max_digits=6, decimal_places=2)
+        cents_field = CentsPriceField()
+        self.stdout.write('rows: %d' % len(cents))
+        self.timed('serialize Decimal', lambda: [decimal_field.to_representation(v) for v in decimals])
+        self.timed('serialize cents', lambda: [cents_field.to_representation(v) for v in cents])
+        totals = self.timed(
+            'SUM/AVG price_cents', lambda: Vehicle.objects.aggregate(Sum('price_cents'), Avg('price_cents')), 5)
+        self.stdout.write('sum=%s' % cents_field.to_representation(totals['price_cents__sum']))
@@ -0,0 +1,50 @@
+import multiprocessing
+import os
+import socket
+
+from django.core.management.base import BaseCommand
+from django.db import connections
+
+from api import jobs
+
+
+def _worker_main(name, burst):
+    #forkしたプロセスでは親のDB接続を使わず、新しく接続する
+    connections.close_all()
+    jobs.work(name, burst=burst)
+
+
+#api_jobテーブルのジョブを実行するworkerを起動する
+#brokerは不要で、DBだけで動く。workerが落ちても、heartbeatが途絶えたジョブはほかのworkerがやり直す
+class Command(BaseCommand):
+    help = 'Run background job workers in a process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=jobs.get_setting('PROCESSES'))
+        parser.add_argument('--burst', action='store_true', help='exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        prefix = '%s:%d' % (socket.gethostname(), os.getpid())
+        if options['processes'] <= 1:
+            #1プロセスならforkせずにそのまま実行する
+            jobs.work(prefix, burst=options['burst'])
+            return
+        #fork前に親のDB接続を閉じておく
+        connections.close_all()
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_worker_main, args=('%s-%d' % (prefix, i), options['burst']))
+            for i in range(options['processes'])
+        ]
+        for worker in workers:
+            worker.start()
+        self.stdout.write('started %d workers' % len(workers))
+        try:
+            for worker in workers:
+                worker.join()
+        except KeyboardInterrupt:
+            #実行中だったジョブはheartbeatのタイムアウト後に別のworkerがやり直す
+            for worker in workers:
+                worker.terminate()
+            for worker in workers:
+                worker.join()
@@ -0,0 +1,17 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from api.analytics import get_price_stats
+
+
+#/api/vehicles/stats/と同じ集計結果をJSONで出力する
+class Command(BaseCommand):
+    help = 'Print vehicle price quantiles, release_year trends and brand/segment distributions'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--no-cache', action='store_true', help='recompute even if a cached result exists')
+
+    def handle(self, *args, **options):
+        stats = get_price_stats(use_cache=not options['no_cache'])
+        self.stdout.write(json.dumps(stats, indent=2))
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.messages.middleware import MessageMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.middleware.clickjacking import XFrameOptionsMiddleware
+from django.middleware.csrf import CsrfViewMiddleware
+
+
+#/api/はTokenAuthenticationだけで認証しているので、session、csrf、messagesなどの処理は不要
+#このmixinを付けたmiddlewareは、/api/へのリクエストでは何もせずに次へ渡す
+#/admin/など、それ以外のurlでは元のmiddlewareと全く同じ動きをする
+class SkipForApiMixin:
+    sync_capable = True
+    async_capable = False
+
+    def _is_api(self, request):
+        return request.path_info.startswith(settings.API_PATH_PREFIX)
+
+    def __call__(self, request):
+        if self._is_api(request):
+            return self.get_response(request)
+        return super().__call__(request)
+
+    def process_view(self, request, callback, callback_args, callback_kwargs):
+        if self._is_api(request) or not hasattr(super(), 'process_view'):
+            return None
+        return super().process_view(request, callback, callback_args, callback_kwargs)
+
+
+class ApiSkipSessionMiddleware(SkipForApiMixin, SessionMiddleware):
+    pass
+
+
+class ApiSkipCsrfViewMiddleware(SkipForApiMixin, CsrfViewMiddleware):
+    pass
+
+
+class ApiSkipAuthenticationMiddleware(SkipForApiMixin, AuthenticationMiddleware):
+    pass
+
+
+class ApiSkipMessageMiddleware(SkipForApiMixin, MessageMiddleware):
+    pass
+
+
+class ApiSkipXFrameOptionsMiddleware(SkipForApiMixin, XFrameOptionsMiddleware):
+    pass
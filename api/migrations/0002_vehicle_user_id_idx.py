@@ -0,0 +1,17 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['user', 'id'], name='api_vehicle_user_id_idx'),
+        ),
+    ]
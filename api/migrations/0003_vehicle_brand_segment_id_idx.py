@@ -0,0 +1,21 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_vehicle_user_id_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['brand', 'id'], name='api_vehicle_brand_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['segment', 'id'], name='api_vehicle_segment_id_idx'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:42
+
+from django.db import migrations, models
+
+
+#ユニーク制約を付ける前に、同じ名前のbrand、segmentを一番小さいidのものにまとめる
+#重複していた側のvehicleは残したidに付け替える
+def merge_duplicates(apps, schema_editor):
+    Vehicle = apps.get_model('api', 'Vehicle')
+    for model_name, field in (('Brand', 'brand_name'), ('Segment', 'segment_name')):
+        model = apps.get_model('api', model_name)
+        fk = model_name.lower()
+        keep = {}
+        for pk, name in model.objects.order_by('id').values_list('id', field):
+            if name not in keep:
+                keep[name] = pk
+                continue
+            Vehicle.objects.filter(**{fk: pk}).update(**{fk: keep[name]})
+            model.objects.filter(pk=pk).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_vehicle_brand_segment_id_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='brand',
+            name='brand_name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='segment',
+            name='segment_name',
+            field=models.CharField(max_length=100, unique=True),
+        ),
+    ]
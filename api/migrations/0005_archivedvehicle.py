@@ -0,0 +1,32 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:44
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0004_unique_brand_segment_name'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedVehicle',
+            fields=[
+                ('vehicle_name', models.CharField(max_length=100)),
+                ('release_year', models.IntegerField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('id', models.IntegerField(primary_key=True, serialize=False)),
+                ('archived_at', models.DateTimeField(auto_now_add=True)),
+                ('brand', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.brand')),
+                ('segment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.segment')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+    ]
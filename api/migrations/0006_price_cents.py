@@ -0,0 +1,73 @@
+# Generated by Django 3.1.14 on 2026-10-19 18:58
+
+from django.db import migrations, models
+from django.db.models import DecimalField, ExpressionWrapper, F, IntegerField, Value
+from django.db.models.functions import Cast, Round
+
+
+#DecimalFieldのpriceをセント単位の整数price_centsに移す
+def price_to_cents(apps, schema_editor):
+    for model_name in ('Vehicle', 'ArchivedVehicle'):
+        model = apps.get_model('api', model_name)
+        model.objects.update(price_cents=Cast(Round(F('price') * 100), IntegerField()))
+
+
+def cents_to_price(apps, schema_editor):
+    for model_name in ('Vehicle', 'ArchivedVehicle'):
+        model = apps.get_model('api', model_name)
+        price = ExpressionWrapper(F('price_cents') / Value(100.0), output_field=DecimalField(max_digits=6, decimal_places=2))
+        model.objects.update(price=price)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0005_archivedvehicle'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='vehicle',
+            name='price_cents',
+            field=models.IntegerField(null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedvehicle',
+            name='price_cents',
+            field=models.IntegerField(null=True),
+        ),
+        #逆向きのmigrationでpriceを戻せるよう、削除する前にnullを許可しておく
+        migrations.AlterField(
+            model_name='vehicle',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=6, null=True),
+        ),
+        migrations.AlterField(
+            model_name='archivedvehicle',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=6, null=True),
+        ),
+        migrations.RunPython(price_to_cents, cents_to_price),
+        migrations.AlterField(
+            model_name='vehicle',
+            name='price_cents',
+            field=models.IntegerField(),
+        ),
+        migrations.AlterField(
+            model_name='archivedvehicle',
+            name='price_cents',
+            field=models.IntegerField(),
+        ),
+        migrations.RemoveField(
+            model_name='vehicle',
+            name='price',
+        ),
+        migrations.RemoveField(
+            model_name='archivedvehicle',
+            name='price',
+        ),
+        migrations.AddIndex(
+            model_name='vehicle',
+            index=models.Index(fields=['price_cents'], name='api_vehicle_price_cents_idx'),
+        ),
+    ]
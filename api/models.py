@@ -1,3 +1,4 @@
+from decimal import Decimal, ROUND_HALF_UP
 from django.db import models
 from django.contrib.auth.models import User
 
@@ -6,20 +7,22 @@ from django.contrib.auth.models import User
 
 class Segment(models.Model):
     #最大100の文字列フィールド
-    segment_name = models.CharField(max_length=100)
+    #名前で検索・upsertするため、重複を許さない(ユニークインデックスが作られる)
+    segment_name = models.CharField(max_length=100, unique=True)
     #printするとsegment_nameが返る？adminページの名前になる
     def __str__(self):
         return self.segment_name
 
 
 class Brand(models.Model):
-    brand_name = models.CharField(max_length=100)
+    brand_name = models.CharField(max_length=100, unique=True)
 
     def __str__(self):
         return self.brand_name
 
 
-class Vehicle(models.Model):
+#vehicleとarchivedvehicleで共通のフィールド
+class BaseVehicle(models.Model):
     # Users消えたらCASCADEも消す
     user = models.ForeignKey(
         User,
@@ -28,8 +31,9 @@ class Vehicle(models.Model):
     vehicle_name = models.CharField(max_length=100)
     #整数フィールド
     release_year = models.IntegerField()
-    #小数点以下2桁、全桁6の浮動小数点フィールド
-    price = models.DecimalField(max_digits=6, decimal_places=2)
+    #価格はセント単位の整数で保存する(500.12 -> 50012)
+    #sqliteでもSUMやAVG、範囲検索が正確で速く、行ごとのDecimalへの変換も不要になる
+    price_cents = models.IntegerField()
     segment = models.ForeignKey(
         Segment,
         on_delete=models.CASCADE
@@ -39,5 +43,92 @@ class Vehicle(models.Model):
         on_delete=models.CASCADE
     )
 
+    class Meta:
+        abstract = True
+
     def __str__(self):
         return self.vehicle_name
+
+    #今まで通りvehicle.priceでDecimal(小数点以下2桁)として読み書きできるようにする
+    @property
+    def price(self):
+        if self.price_cents is None:
+            return None
+        return Decimal(self.price_cents).scaleb(-2)
+
+    @price.setter
+    def price(self, value):
+        #floatは誤差を避けるため文字列を経由して変換する
+        value = Decimal(str(value)) if isinstance(value, float) else Decimal(value)
+        self.price_cents = int(value.scaleb(2).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+class Vehicle(BaseVehicle):
+
+    class Meta:
+        indexes = [
+            #「自分のvehicle一覧」を(user, id)の範囲スキャンで返すための複合インデックス
+            models.Index(fields=['user', 'id'], name='api_vehicle_user_id_idx'),
+            #brand、segmentごとのvehicle一覧(/api/brands/{id}/vehicles/など)を範囲スキャンで返すためのインデックス
+            models.Index(fields=['brand', 'id'], name='api_vehicle_brand_id_idx'),
+            models.Index(fields=['segment', 'id'], name='api_vehicle_segment_id_idx'),
+            #?min_price=、?max_price=での範囲検索用
+            models.Index(fields=['price_cents'], name='api_vehicle_price_cents_idx'),
+        ]
+
+
+#release_yearが古いvehicleの移動先(manage.py archive_vehiclesで移す)
+#api_vehicleを小さく保つことで、よく使われる新しいvehicleのインデックスやスキャンを速くする
+class ArchivedVehicle(BaseVehicle):
+    #idは元のvehicleのものをそのまま使う
+    id = models.IntegerField(primary_key=True)
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+
+#時間のかかる処理(エクスポート、インポート、一括削除、集計の作り直し)のジョブ
+#api_jobテーブルがそのままキューになり、manage.py run_workersのworkerが取り出して実行する
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    SUCCEEDED = 'succeeded'
+    FAILED = 'failed'
+    CANCELLED = 'cancelled'
+    STATUS_CHOICES = [
+        (QUEUED, 'Queued'),
+        (RUNNING, 'Running'),
+        (SUCCEEDED, 'Succeeded'),
+        (FAILED, 'Failed'),
+        (CANCELLED, 'Cancelled'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE
+    )
+    #api/jobs.pyに登録されている処理の名前
+    kind = models.CharField(max_length=50)
+    params = models.JSONField(default=dict, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=QUEUED)
+    #進捗(processed / total件)
+    processed = models.IntegerField(default=0)
+    total = models.IntegerField(null=True, blank=True)
+    result = models.JSONField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    #実行中のジョブをキャンセルする場合はこれを立て、ジョブ側が進捗を報告するときに止まる
+    cancel_requested = models.BooleanField(default=False)
+    attempts = models.IntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    #workerが生きていることを示す時刻。古いまま止まっているジョブはworkerが落ちたとみなしてやり直す
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            #キューから次のジョブを取り出すためのインデックス
+            models.Index(fields=['status', 'id'], name='api_job_status_id_idx'),
+        ]
+
+    def __str__(self):
+        return '%s #%d (%s)' % (self.kind, self.id, self.status)
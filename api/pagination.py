@@ -0,0 +1,11 @@
+from rest_framework.pagination import CursorPagination
+
+
+#idでのキーセットページネーション
+#OFFSETを使わず「前回の最後のidより大きいもの」を取るので、(user, id)のインデックスをそのまま範囲スキャンできる
+class VehicleCursorPagination(CursorPagination):
+    ordering = 'id'
+    page_size = 50
+    #?page_size=でクライアントから件数を変えられるようにする(上限あり)
+    page_size_query_param = 'page_size'
+    max_page_size = 500
@@ -0,0 +1,12 @@
+from rest_framework import permissions
+
+
+#vehicleの書き込み(PUT,PATCH,DELETE)は登録した本人だけに許可する
+#obj.user_idはvehicleの行にすでに入っているので、userオブジェクトを取りにいく追加のクエリは発生しない
+class IsOwnerOrReadOnly(permissions.BasePermission):
+
+    def has_object_permission(self, request, view, obj):
+        #GETなどの読み取りは誰でもOK
+        if request.method in permissions.SAFE_METHODS:
+            return True
+        return obj.user_id == request.user.id
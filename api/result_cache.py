@@ -0,0 +1,163 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'ENABLED': True,
+    #この秒数までは、キャッシュをそのまま返す
+    'TTL_SECONDS': 30,
+    #TTLを過ぎてからこの秒数までは、古い結果を返しつつ裏で1つのスレッドだけが作り直す
+    'STALE_SECONDS': 60,
+    #プロセス内に保持する件数の上限。超えたら一番長く使われていないものから捨てる
+    'MAX_ENTRIES': 256,
+    #作り直しのロックを持ち続けられる秒数(作り直していたプロセスが落ちた場合に、ほかのプロセスが引き継ぐまでの時間)
+    'LOCK_SECONDS': 10,
+}
+
+#ほかのプロセスが作り直しているときに、共有キャッシュに結果が入ったかを確認する間隔(秒)
+POLL_SECONDS = 0.05
+
+
+def get_setting(name):
+    return getattr(settings, 'VEHICLE_LIST_CACHE', {}).get(name, DEFAULTS[name])
+
+
+#プロセス内のLRUと、全プロセスで共有するキャッシュ(django.core.cache)の2段のキャッシュ
+#同じキーの計算が同時に必要になった場合は、プロセス内では1つのスレッドだけが計算し(single-flight)、ほかはその結果を待つ
+#プロセスの間では共有キャッシュのロック(cache.add)を取ったプロセスだけが計算し、ほかのプロセスは共有キャッシュに入った結果を使う
+#キーにテーブルのバージョンを含めて使うので、データが変わった後に古い結果が返ることはない
+class ResultCache:
+
+    def __init__(self, name='default'):
+        self.name = name
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self.metrics = {
+            'hits': 0, 'stale_hits': 0, 'shared_hits': 0, 'misses': 0, 'rebuilds': 0, 'evictions': 0,
+        }
+
+    #clear()で共有キャッシュのものも使われなくなるよう、キーに世代を含める
+    def _shared_key(self, key):
+        generation = cache.get_or_set('result_cache:%s:generation' % self.name, time.time_ns, None)
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return 'result_cache:%s:%s:%s' % (self.name, generation, digest)
+
+    def get_or_build(self, key, build):
+        ttl = get_setting('TTL_SECONDS')
+        shared_key = self._shared_key(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+        if entry is None or time.time() - entry[1] >= ttl:
+            #ほかのプロセスが作った(作り直した)結果があれば、それを使う
+            shared = cache.get(shared_key)
+            if shared is not None and (entry is None or shared[1] > entry[1]):
+                entry = shared
+                with self._lock:
+                    self.metrics['shared_hits'] += 1
+                    self._store(key, entry)
+        with self._lock:
+            if entry is not None:
+                value, built_at = entry
+                age = time.time() - built_at
+                if age < ttl:
+                    self.metrics['hits'] += 1
+                    return value
+                if age < ttl + get_setting('STALE_SECONDS'):
+                    self.metrics['stale_hits'] += 1
+                    if key not in self._inflight:
+                        self._inflight[key] = threading.Event()
+                        threading.Thread(
+                            target=self._revalidate, args=(key, shared_key, build, built_at), daemon=True,
+                        ).start()
+                    return value
+            self.metrics['misses'] += 1
+            event = self._inflight.get(key)
+            leader = event is None
+            if leader:
+                event = self._inflight[key] = threading.Event()
+        if leader:
+            return self._rebuild(key, shared_key, build)[0]
+        #ほかのスレッドが計算中なので、終わるのを待ってその結果を使う
+        event.wait()
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is not None:
+            return entry[0]
+        #計算していたスレッドが失敗した場合は自分で計算する
+        return build()
+
+    #プロセス内のLRUに入れる(self._lockを持って呼ぶこと)
+    def _store(self, key, entry):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > get_setting('MAX_ENTRIES'):
+            self._entries.popitem(last=False)
+            self.metrics['evictions'] += 1
+
+    #built_atより新しい結果を作るか、ほかのプロセスが作ったものを受け取る
+    #waitがFalseなら、ほかのプロセスが作り直している間は待たずにNoneを返す
+    def _rebuild(self, key, shared_key, build, built_at=0, wait=True):
+        try:
+            entry = self._build_once(shared_key, build, built_at, wait)
+            if entry is not None:
+                with self._lock:
+                    self._store(key, entry)
+            return entry
+        finally:
+            with self._lock:
+                event = self._inflight.pop(key)
+            event.set()
+
+    def _build_once(self, shared_key, build, built_at, wait):
+        lock_key = shared_key + ':lock'
+        lock_seconds = get_setting('LOCK_SECONDS')
+        deadline = time.monotonic() + lock_seconds
+        locked = cache.add(lock_key, 1, lock_seconds)
+        while not locked:
+            if not wait:
+                return None
+            #ほかのプロセスが作り直しているので、共有キャッシュに入るのを待つ
+            time.sleep(POLL_SECONDS)
+            shared = cache.get(shared_key)
+            if shared is not None and shared[1] > built_at:
+                with self._lock:
+                    self.metrics['shared_hits'] += 1
+                return shared
+            if time.monotonic() > deadline:
+                #作り直しが終わらない(ロックを持っていたプロセスが落ちたなど)ので、自分で作る
+                break
+            locked = cache.add(lock_key, 1, lock_seconds)
+        try:
+            entry = (build(), time.time())
+            cache.set(shared_key, entry, get_setting('TTL_SECONDS') + get_setting('STALE_SECONDS'))
+            with self._lock:
+                self.metrics['rebuilds'] += 1
+            return entry
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+    def _revalidate(self, key, shared_key, build, built_at):
+        try:
+            self._rebuild(key, shared_key, build, built_at, wait=False)
+        except Exception:
+            logger.exception('failed to revalidate %r', key)
+        finally:
+            #別スレッドで開いたDB接続を閉じる
+            connection.close()
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+        cache.set('result_cache:%s:generation' % self.name, time.time_ns(), None)
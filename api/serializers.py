@@ -1,6 +1,54 @@
+from django.db import IntegrityError
 from rest_framework import serializers
-from .models import Segment, Brand, Vehicle
+from .models import Segment, Brand, Vehicle, Job
 from django.contrib.auth.models import User
+from .cache import ReferenceCache
+
+#VehicleのFKのバリデーションに使うキャッシュ
+segment_cache = ReferenceCache(Segment)
+brand_cache = ReferenceCache(Brand)
+
+
+#PrimaryKeyRelatedFieldと同じ動きをするが、存在チェックをDBではなくReferenceCacheで行う
+class CachedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+
+    def __init__(self, cache, **kwargs):
+        self.cache = cache
+        kwargs.setdefault('queryset', cache.model.objects.all())
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            pk = int(data)
+        except (TypeError, ValueError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        #contextに先読みした行(prefetch_references)があれば、キャッシュを見ずにそれを使う
+        references = self.context.get('references', {}).get(self.cache.model)
+        if references is not None:
+            obj = references.get(pk)
+        else:
+            obj = self.cache.get(pk)
+        if obj is None:
+            self.fail('does_not_exist', pk_value=data)
+        return obj
+
+
+#複数行をVehicleSerializerでバリデーションするときに、行に含まれるsegment、brandのidをまとめて取得する
+#返り値をserializerのcontextに渡すと、行ごとにキャッシュを確認しなくてよくなる
+def prefetch_references(rows):
+    references = {}
+    for field, cache in (('segment', segment_cache), ('brand', brand_cache)):
+        pks = set()
+        for row in rows:
+            try:
+                pks.add(int(row[field]))
+            except (TypeError, ValueError, KeyError):
+                #不正な値は、行ごとのバリデーションでエラーになる
+                pass
+        references[cache.model] = cache.get_many(pks)
+    return {'references': references}
 
 
 class UserSerializer(serializers.ModelSerializer):
@@ -23,16 +71,61 @@ class UserSerializer(serializers.ModelSerializer):
         return user
 
 
+#segment、brandに紐づくvehicleの数
+#viewのquerysetでannotateしたvehicle_countを使い、annotateされていないインスタンスの場合だけ数える
+class VehicleCountField(serializers.ReadOnlyField):
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        count = getattr(instance, 'vehicle_count', None)
+        if count is None:
+            count = instance.vehicle_set.count()
+        return count
+
+
 class SegmentSerializer(serializers.ModelSerializer):
+    vehicle_count = VehicleCountField()
+
     class Meta:
         model = Segment
-        fields = ['id', 'segment_name']
+        fields = ['id', 'segment_name', 'vehicle_count']
 
 
 class BrandSerializer(serializers.ModelSerializer):
+    vehicle_count = VehicleCountField()
+
     class Meta:
         model = Brand
-        fields = ['id', 'brand_name']
+        fields = ['id', 'brand_name', 'vehicle_count']
+
+
+#セント単位の整数で保存しているpriceを、今まで通り"500.12"の文字列で入出力するfield
+#入力のバリデーションはDecimalField(全桁6、小数点以下2桁)のまま
+class CentsPriceField(serializers.DecimalField):
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('max_digits', 6)
+        kwargs.setdefault('decimal_places', 2)
+        kwargs.setdefault('source', 'price_cents')
+        super().__init__(**kwargs)
+
+    def to_internal_value(self, data):
+        value = super().to_internal_value(data)
+        return int(value.scaleb(2))
+
+    def to_representation(self, value):
+        #Decimalを作らずに整数から直接文字列にする
+        sign = '-' if value < 0 else ''
+        units, cents = divmod(abs(value), 100)
+        return '%s%d.%02d' % (sign, units, cents)
+
+
+#/api/brands/upsert/、/api/segments/upsert/の入力
+class UpsertNamesSerializer(serializers.Serializer):
+    names = serializers.ListField(child=serializers.CharField(max_length=100), allow_empty=False)
 
 
 class VehicleSerializer(serializers.ModelSerializer):
@@ -41,6 +134,10 @@ class VehicleSerializer(serializers.ModelSerializer):
     #引数のsourceのsegmentがmodelの名前、segment_nameが取得したい、segmentがもつ属性
     segment_name = serializers.ReadOnlyField(source='segment.segment_name', read_only=True)
     brand_name = serializers.ReadOnlyField(source='brand.brand_name', read_only=True)
+    #書き込み時のsegment、brandの存在チェックはキャッシュで行い、FKごとのSELECTを省く
+    segment = CachedPrimaryKeyRelatedField(cache=segment_cache)
+    brand = CachedPrimaryKeyRelatedField(cache=brand_cache)
+    price = CentsPriceField()
 
     class Meta:
         model = Vehicle
@@ -48,4 +145,83 @@ class VehicleSerializer(serializers.ModelSerializer):
         #新しくsegmentとbrandのオブジェクト内の、segment_nameとbrand_nameを使って文字列を表示したいから、fieldに追加
         fields = ['id', 'vehicle_name', 'release_year', 'price', 'segment','brand', 'segment_name', 'brand_name']
         # viewsで、登録した人が誰なのかをログインしている情報から取得するため、readonlyに設定
-        extra_kwargs = {'user': {'read_only': True}}
\ No newline at end of file
+        extra_kwargs = {'user': {'read_only': True}}
+
+    def create(self, validated_data):
+        try:
+            return super().create(validated_data)
+        except IntegrityError as exc:
+            self.raise_for_missing_references(exc)
+
+    def update(self, instance, validated_data):
+        try:
+            return super().update(instance, validated_data)
+        except IntegrityError as exc:
+            self.raise_for_missing_references(exc)
+
+    #保存がFKの制約違反で失敗した場合に呼ぶ
+    #バリデーションの後に削除されたsegment、brandだった場合は、キャッシュから消して400にする(それ以外はexcをそのまま投げる)
+    def raise_for_missing_references(self, exc):
+        errors = {}
+        for field, cache in (('segment', segment_cache), ('brand', brand_cache)):
+            obj = self.validated_data.get(field)
+            if obj is not None and not cache.model.objects.filter(pk=obj.pk).exists():
+                cache.evict(obj.pk)
+                errors[field] = [self.fields[field].error_messages['does_not_exist'].format(pk_value=obj.pk)]
+        if not errors:
+            raise exc
+        raise serializers.ValidationError(errors)
+
+
+#ジョブのkindごとのparams(api/jobs.pyの各ハンドラのコメントを参照)
+#workerで失敗する前に、登録のときに400で返す
+class ImportVehiclesParamsSerializer(serializers.Serializer):
+    #各行の中身はworkerでVehicleSerializerを通し、行ごとのエラーとして記録するので、ここではオブジェクトのリストかだけを確認する
+    vehicles = serializers.ListField(child=serializers.DictField())
+
+
+class DeleteVehiclesParamsSerializer(serializers.Serializer):
+    release_year_before = serializers.IntegerField()
+
+
+#paramsを取らないkindはここに入れない
+JOB_PARAMS_SERIALIZERS = {
+    'import_vehicles': ImportVehiclesParamsSerializer,
+    'delete_vehicles': DeleteVehiclesParamsSerializer,
+}
+
+
+class JobSerializer(serializers.ModelSerializer):
+
+    class Meta:
+        model = Job
+        fields = [
+            'id', 'kind', 'params', 'status', 'processed', 'total', 'result', 'error',
+            'cancel_requested', 'attempts', 'created_at', 'started_at', 'finished_at',
+        ]
+        #登録時に指定できるのはkindとparamsだけ
+        read_only_fields = [
+            'status', 'processed', 'total', 'result', 'error',
+            'cancel_requested', 'attempts', 'created_at', 'started_at', 'finished_at',
+        ]
+
+    def validate_kind(self, value):
+        #循環importを避けるためここでimportする(jobs.pyがこのファイルをimportしている)
+        from .jobs import HANDLERS
+        if value not in HANDLERS:
+            raise serializers.ValidationError('Unknown job kind. Choices: %s' % ', '.join(sorted(HANDLERS)))
+        return value
+
+    def validate(self, attrs):
+        params = attrs.get('params', {})
+        if not isinstance(params, dict):
+            raise serializers.ValidationError({'params': 'Expected an object.'})
+        params_serializer_class = JOB_PARAMS_SERIALIZERS.get(attrs['kind'])
+        if params_serializer_class is not None:
+            params_serializer = params_serializer_class(data=params)
+            if not params_serializer.is_valid():
+                raise serializers.ValidationError({'params': params_serializer.errors})
+            #workerには確認済みの値(数値に変換したものなど)を渡す
+            params = params_serializer.validated_data
+        attrs['params'] = params
+        return attrs
@@ -0,0 +1,39 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Segment, Brand, Vehicle, ArchivedVehicle
+from .cache import bump_table_version
+from .events import broker
+
+
+#segment、brand、vehicle(アーカイブを含む)が変更されたらテーブルのバージョンを上げて、キャッシュを無効化する
+#バージョンはcommitされてから上がる(api/cache.pyのbump_table_version)
+#bulk_createやQuerySet.update()ではsignalsが飛ばないので、その場合はbump_table_versionを直接呼ぶこと
+@receiver([post_save, post_delete], sender=Vehicle)
+@receiver([post_save, post_delete], sender=ArchivedVehicle)
+@receiver([post_save, post_delete], sender=Segment)
+@receiver([post_save, post_delete], sender=Brand)
+def invalidate_table_version(sender, **kwargs):
+    bump_table_version(sender)
+
+
+#変更をServer-Sent Events(/api/events/)の購読者に送る
+#rollbackされた変更を送らないよう、commitされてからpublishする
+@receiver(post_save, sender=Vehicle)
+@receiver(post_save, sender=Segment)
+@receiver(post_save, sender=Brand)
+def publish_save(sender, instance, created, **kwargs):
+    action = 'created' if created else 'updated'
+    publish_on_commit(sender, action, instance.pk)
+
+
+@receiver(post_delete, sender=Vehicle)
+@receiver(post_delete, sender=Segment)
+@receiver(post_delete, sender=Brand)
+def publish_delete(sender, instance, **kwargs):
+    publish_on_commit(sender, 'deleted', instance.pk)
+
+
+#bulk_createやraw SQLで作成した行は、signalsが飛ばないのでこれを直接呼ぶこと
+def publish_on_commit(model, action, pk):
+    transaction.on_commit(lambda: broker.publish(model._meta.model_name, action, pk))
@@ -0,0 +1,137 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache as shared_cache
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from rest_framework.test import APIClient
+from .models import Vehicle, Brand, Segment
+from .result_cache import ResultCache
+from .views import vehicle_list_cache
+
+VEHICLES_URL = '/api/vehicles/'
+
+
+class ResultCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        shared_cache.clear()
+
+    #同じキーを同時に要求しても、計算は1回だけか
+    def test_10_1_should_build_once_for_concurrent_misses(self):
+        cache = ResultCache()
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.1)
+            return 'value'
+
+        with ThreadPoolExecutor(8) as pool:
+            results = list(pool.map(lambda _: cache.get_or_build('key', build), range(8)))
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.metrics['rebuilds'], 1)
+
+    #TTLを過ぎたら古い値を返しつつ、裏で作り直すか
+    @override_settings(VEHICLE_LIST_CACHE={'TTL_SECONDS': 0, 'STALE_SECONDS': 60})
+    def test_10_2_should_serve_stale_while_revalidating(self):
+        cache = ResultCache()
+        rebuilt = threading.Event()
+        cache.get_or_build('key', lambda: 'old')
+
+        def build():
+            rebuilt.set()
+            return 'new'
+
+        self.assertEqual(cache.get_or_build('key', build), 'old')
+        self.assertTrue(rebuilt.wait(1))
+        self.assertEqual(cache.metrics['stale_hits'], 1)
+
+    #上限を超えたら、一番長く使われていないものから捨てるか
+    @override_settings(VEHICLE_LIST_CACHE={'MAX_ENTRIES': 2})
+    def test_10_3_should_evict_least_recently_used(self):
+        cache = ResultCache()
+        cache.get_or_build('a', lambda: 1)
+        cache.get_or_build('b', lambda: 2)
+        cache.get_or_build('a', lambda: 1)
+        cache.get_or_build('c', lambda: 3)
+        self.assertEqual(cache.get_or_build('a', lambda: 'rebuilt'), 1)
+        self.assertEqual(cache.metrics['evictions'], 1)
+        #プロセス内からは消えても、共有キャッシュに残っているものは作り直さずに使う
+        self.assertEqual(cache.get_or_build('b', lambda: 'rebuilt'), 2)
+        self.assertEqual(cache.metrics['shared_hits'], 1)
+        self.assertEqual(cache.metrics['evictions'], 2)
+        cache.clear()
+        self.assertEqual(cache.get_or_build('b', lambda: 'rebuilt'), 'rebuilt')
+
+    #別のプロセス(同じ名前の別のインスタンス)で同時に必要になっても、計算は1回だけか
+    def test_10_6_should_build_once_across_processes(self):
+        processes = [ResultCache('shared'), ResultCache('shared')]
+        calls = []
+
+        def build():
+            calls.append(1)
+            time.sleep(0.2)
+            return 'value'
+
+        with ThreadPoolExecutor(2) as pool:
+            results = list(pool.map(lambda cache: cache.get_or_build('key', build), processes))
+        self.assertEqual(results, ['value', 'value'])
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(sum(cache.metrics['shared_hits'] for cache in processes), 1)
+
+    #別のプロセスが作り直した結果を、TTLが過ぎた後に使うか
+    @override_settings(VEHICLE_LIST_CACHE={'TTL_SECONDS': 0.2, 'STALE_SECONDS': 60})
+    def test_10_7_should_use_result_rebuilt_by_another_process(self):
+        first, second = ResultCache('shared'), ResultCache('shared')
+        first.get_or_build('key', lambda: 'old')
+        self.assertEqual(second.get_or_build('key', lambda: 'unexpected'), 'old')
+        time.sleep(0.25)
+        rebuilt = threading.Event()
+
+        def build():
+            rebuilt.set()
+            return 'new'
+
+        self.assertEqual(first.get_or_build('key', build), 'old')
+        self.assertTrue(rebuilt.wait(1))
+        #作り直した結果が共有キャッシュに入るまで待つ
+        time.sleep(0.1)
+        self.assertEqual(second.get_or_build('key', lambda: 'unexpected'), 'new')
+
+
+#一覧のキャッシュはcommitされてから無効になるので、TransactionTestCaseを使う
+class VehicleListCacheTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.segment = Segment.objects.create(segment_name='Sedan')
+        self.brand = Brand.objects.create(brand_name='Tesla')
+        vehicle_list_cache.clear()
+
+    def create_vehicle(self):
+        return Vehicle.objects.create(
+            user=self.user, vehicle_name='MODEL S', release_year=2019, price=500,
+            segment=self.segment, brand=self.brand)
+
+    #2回目の一覧はDBにアクセスせずに返るか
+    def test_10_4_should_serve_vehicle_list_from_cache(self):
+        self.create_vehicle()
+        first = self.client.get(VEHICLES_URL)
+        with self.assertNumQueries(0):
+            second = self.client.get(VEHICLES_URL)
+        self.assertEqual(first.data, second.data)
+
+    #vehicleやbrandが変わったら作り直されるか
+    def test_10_5_should_rebuild_after_change(self):
+        self.create_vehicle()
+        self.client.get(VEHICLES_URL)
+        self.create_vehicle()
+        self.assertEqual(len(self.client.get(VEHICLES_URL).data), 2)
+        self.brand.brand_name = 'Tesla Motors'
+        self.brand.save()
+        self.assertEqual(self.client.get(VEHICLES_URL).data[0]['brand_name'], 'Tesla Motors')
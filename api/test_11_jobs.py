@@ -0,0 +1,263 @@
+import csv
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APIClient
+from . import jobs
+from .models import Job, Vehicle, Brand, Segment
+from .serializers import VehicleSerializer
+
+JOBS_URL = '/api/jobs/'
+
+
+#workerのプロセスが落ちたことにする(run_jobのexcept Exceptionで捕まらないようにBaseException)
+class WorkerKilled(BaseException):
+    pass
+
+
+def detail_url(job_id):
+    return reverse('api:job-detail', args=[job_id])
+
+
+def cancel_url(job_id):
+    return reverse('api:job-cancel', args=[job_id])
+
+
+def download_url(job_id):
+    return reverse('api:job-download', args=[job_id])
+
+
+class JobApiTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.segment = Segment.objects.create(segment_name='Sedan')
+        self.brand = Brand.objects.create(brand_name='Tesla')
+
+    def create_vehicle(self, release_year=2019, user=None):
+        return Vehicle.objects.create(
+            user=user or self.user, vehicle_name='MODEL S', release_year=release_year, price=500,
+            segment=self.segment, brand=self.brand)
+
+    def submit(self, kind, params):
+        res = self.client.post(JOBS_URL, {'kind': kind, 'params': params}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        return res.data['id']
+
+    #ジョブを登録してworkerで実行し、状態と結果を取得できるか
+    def test_11_1_should_submit_and_run_job(self):
+        self.create_vehicle(release_year=1990)
+        self.create_vehicle(release_year=2020)
+        other = self.create_vehicle(release_year=1990, user=get_user_model().objects.create_user(username='other'))
+        job_id = self.submit('delete_vehicles', {'release_year_before': 2000})
+        self.assertEqual(self.client.get(detail_url(job_id)).data['status'], Job.QUEUED)
+        call_command('run_workers', processes=1, burst=True, stdout=StringIO())
+        res = self.client.get(detail_url(job_id))
+        self.assertEqual(res.data['status'], Job.SUCCEEDED)
+        self.assertEqual(res.data['result'], {'deleted': 1})
+        self.assertEqual((res.data['processed'], res.data['total']), (1, 1))
+        #ほかのユーザーのvehicleは消えない
+        self.assertTrue(Vehicle.objects.filter(id=other.id).exists())
+
+    def test_11_2_should_not_submit_unknown_kind(self):
+        res = self.client.post(JOBS_URL, {'kind': 'unknown', 'params': {}}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    #エクスポートとインポート
+    def test_11_3_should_export_and_import_vehicles(self):
+        self.create_vehicle()
+        with tempfile.TemporaryDirectory() as export_dir, override_settings(JOBS={'EXPORT_DIR': export_dir}):
+            export_id = self.submit('export_vehicles', {})
+            import_id = self.submit('import_vehicles', {'vehicles': [
+                {'vehicle_name': 'MODEL X', 'release_year': 2020, 'price': '600.50',
+                 'segment': self.segment.id, 'brand': self.brand.id},
+                {'vehicle_name': 'MODEL Y'},
+            ]})
+            call_command('run_workers', processes=1, burst=True, stdout=StringIO())
+            #書き出したCSVはAPIからダウンロードできる
+            res = self.client.get(download_url(export_id))
+            self.assertEqual(res.status_code, status.HTTP_200_OK)
+            self.assertEqual(res['Content-Type'], 'text/csv')
+            rows = list(csv.DictReader(StringIO(b''.join(res.streaming_content).decode())))
+        export = Job.objects.get(id=export_id)
+        self.assertEqual(export.result['rows'], 1)
+        self.assertEqual(rows[0]['price'], '500.00')
+        result = Job.objects.get(id=import_id).result
+        self.assertEqual(result['created'], 1)
+        self.assertIn('1', result['errors'])
+        self.assertTrue(Vehicle.objects.filter(vehicle_name='MODEL X', user=self.user).exists())
+
+    #キュー待ちのジョブはすぐにキャンセルされるか
+    def test_11_4_should_cancel_queued_job(self):
+        job_id = self.submit('rebuild_stats', {})
+        res = self.client.post(cancel_url(job_id))
+        self.assertEqual(res.data['status'], Job.CANCELLED)
+        call_command('run_workers', processes=1, burst=True, stdout=StringIO())
+        self.assertEqual(Job.objects.get(id=job_id).status, Job.CANCELLED)
+
+    #実行中のジョブは、次に進捗を報告したところで止まるか
+    def test_11_5_should_cancel_running_job(self):
+        self.create_vehicle(release_year=1990)
+        job_id = self.submit('delete_vehicles', {'release_year_before': 2000})
+        job = jobs.claim_next_job('test-worker')
+        res = self.client.post(cancel_url(job_id))
+        self.assertTrue(res.data['cancel_requested'])
+        self.assertEqual(res.data['status'], Job.RUNNING)
+        jobs.run_job(job)
+        self.assertEqual(Job.objects.get(id=job_id).status, Job.CANCELLED)
+        self.assertEqual(1, Vehicle.objects.count())
+
+    #workerが落ちてheartbeatが途絶えたジョブは、キューに戻されてやり直されるか
+    def test_11_6_should_recover_job_from_crashed_worker(self):
+        job_id = self.submit('rebuild_stats', {})
+        jobs.claim_next_job('crashed-worker')
+        Job.objects.filter(id=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.recover_stale_jobs(), 1)
+        call_command('run_workers', processes=1, burst=True, stdout=StringIO())
+        job = Job.objects.get(id=job_id)
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertEqual(job.attempts, 2)
+
+    #やり直しの上限を超えたら失敗にするか
+    @override_settings(JOBS={'MAX_ATTEMPTS': 1})
+    def test_11_7_should_fail_job_after_max_attempts(self):
+        job_id = self.submit('rebuild_stats', {})
+        jobs.claim_next_job('crashed-worker')
+        Job.objects.filter(id=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        jobs.recover_stale_jobs()
+        job = Job.objects.get(id=job_id)
+        self.assertEqual(job.status, Job.FAILED)
+        self.assertEqual(job.error, 'worker stopped responding')
+
+    #他人のジョブは見えないか
+    def test_11_8_should_not_get_others_job(self):
+        other = get_user_model().objects.create_user(username='other')
+        job = Job.objects.create(user=other, kind='rebuild_stats')
+        res = self.client.get(detail_url(job.id))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(JOBS_URL).data, [])
+
+    #インポートの途中でworkerが落ちても、やり直しでcommit済みの行が二重に作成されないか
+    @override_settings(JOBS={'BATCH_SIZE': 2})
+    def test_11_9_should_resume_import_without_duplicates(self):
+        rows = [
+            {'vehicle_name': 'MODEL %d' % i, 'release_year': 2020, 'price': '100.00',
+             'segment': self.segment.id, 'brand': self.brand.id}
+            for i in range(5)
+        ]
+        rows[1]['brand'] = 0
+        job_id = self.submit('import_vehicles', {'vehicles': rows})
+        job = jobs.claim_next_job('crashed-worker')
+        save = VehicleSerializer.save
+        saved = []
+
+        def crash_on_third_save(serializer, **kwargs):
+            saved.append(serializer)
+            if len(saved) == 3:
+                raise WorkerKilled
+            return save(serializer, **kwargs)
+
+        with mock.patch.object(VehicleSerializer, 'save', crash_on_third_save):
+            with self.assertRaises(WorkerKilled):
+                jobs.run_job(job)
+        #1つ目のバッチだけがcommitされている
+        self.assertEqual(Vehicle.objects.count(), 1)
+        self.assertEqual(Job.objects.get(id=job_id).processed, 2)
+        Job.objects.filter(id=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        self.assertEqual(jobs.recover_stale_jobs(), 1)
+        call_command('run_workers', processes=1, burst=True, stdout=StringIO())
+        job = Job.objects.get(id=job_id)
+        self.assertEqual((job.status, job.attempts), (Job.SUCCEEDED, 2))
+        self.assertEqual(job.result['created'], 4)
+        self.assertEqual(list(job.result['errors']), ['1'])
+        self.assertEqual(Vehicle.objects.count(), 4)
+        self.assertEqual(
+            sorted(Vehicle.objects.values_list('vehicle_name', flat=True)),
+            ['MODEL 0', 'MODEL 2', 'MODEL 3', 'MODEL 4'])
+
+    #キューに戻されてほかのworkerがやり直しているジョブを、前の実行が上書きしないか
+    def test_11_10_should_not_overwrite_retried_job(self):
+        job_id = self.submit('rebuild_stats', {})
+        first = jobs.claim_next_job('crashed-worker')
+        Job.objects.filter(id=job_id).update(heartbeat_at=timezone.now() - timedelta(hours=1))
+        jobs.recover_stale_jobs()
+        second = jobs.claim_next_job('new-worker')
+        with self.assertRaises(jobs.JobLost):
+            jobs.report_progress(first, 1)
+        jobs.run_job(first)
+        job = Job.objects.get(id=job_id)
+        self.assertEqual((job.status, job.worker, job.result), (Job.RUNNING, 'new-worker', None))
+        jobs.run_job(second)
+        self.assertEqual(Job.objects.get(id=job_id).status, Job.SUCCEEDED)
+
+    #エクスポート以外のジョブや未完了のジョブはダウンロードできないか
+    def test_11_12_should_not_download_without_export_file(self):
+        other_id = self.submit('rebuild_stats', {})
+        call_command('run_workers', processes=1, burst=True, stdout=StringIO())
+        self.assertEqual(self.client.get(download_url(other_id)).status_code, status.HTTP_404_NOT_FOUND)
+        job_id = self.submit('export_vehicles', {})
+        self.assertEqual(self.client.get(download_url(job_id)).status_code, status.HTTP_404_NOT_FOUND)
+
+    #失敗したジョブのerrorにはtracebackではなく例外のメッセージだけが入るか
+    def test_11_13_should_store_only_error_message(self):
+        def broken(job, params):
+            raise ValueError('price column is missing')
+
+        job = Job.objects.create(user=self.user, kind='broken')
+        with mock.patch.dict(jobs.HANDLERS, {'broken': broken}), self.assertLogs('api.jobs', 'ERROR') as logs:
+            call_command('run_workers', processes=1, burst=True, stdout=StringIO())
+        self.assertIn('Traceback', logs.output[0])
+        res = self.client.get(detail_url(job.id))
+        self.assertEqual(res.data['status'], Job.FAILED)
+        self.assertEqual(res.data['error'], 'price column is missing')
+
+    #kindに合わないparamsは登録のときに400になり、ジョブは作られないか
+    def test_11_14_should_reject_invalid_params(self):
+        for kind, params in (
+            ('delete_vehicles', {}),
+            ('delete_vehicles', {'release_year_before': 'soon'}),
+            ('import_vehicles', {'vehicles': {}}),
+            ('import_vehicles', {'vehicles': [1, 2]}),
+            ('rebuild_stats', []),
+        ):
+            res = self.client.post(JOBS_URL, {'kind': kind, 'params': params}, format='json')
+            self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST, (kind, params))
+            self.assertIn('params', res.data)
+        self.assertFalse(Job.objects.exists())
+        job_id = self.submit('delete_vehicles', {'release_year_before': '2000'})
+        self.assertEqual(Job.objects.get(id=job_id).params, {'release_year_before': 2000})
+
+
+#heartbeatは別スレッド(別のDB接続)から更新されるので、TransactionTestCaseを使う
+class JobHeartbeatTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+
+    #進捗を報告しない長い処理の間も、heartbeatが更新され続けるか
+    @override_settings(JOBS={'HEARTBEAT_SECONDS': 0.05})
+    def test_11_11_should_keep_heartbeat_while_handler_is_silent(self):
+        def silent(job, params):
+            started = Job.objects.get(id=job.id).heartbeat_at
+            time.sleep(0.5)
+            return Job.objects.get(id=job.id).heartbeat_at > started
+
+        Job.objects.create(user=self.user, kind='silent')
+        with mock.patch.dict(jobs.HANDLERS, {'silent': silent}):
+            job = jobs.claim_next_job('test-worker')
+            jobs.run_job(job)
+        job.refresh_from_db()
+        self.assertEqual(job.status, Job.SUCCEEDED)
+        self.assertIs(job.result, True)
+
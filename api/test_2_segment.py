@@ -3,7 +3,7 @@ from django.urls import reverse
 from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Segment
+from .models import Segment, Brand, Vehicle
 from .serializers import SegmentSerializer
 
 SEGMENTS_URL = '/api/segments/'
@@ -107,6 +107,19 @@ class AuthorizedSegmentApiTests(TestCase):
         self.client.delete(url)
         self.assertEqual(0, Segment.objects.count())
 
+    #vehicle_countと/api/segments/{id}/vehicles/のテスト
+    def test_2_9_should_get_vehicles_of_segment(self):
+        segment = create_segment(segment_name="SUV")
+        create_segment(segment_name="Sedan")
+        brand = Brand.objects.create(brand_name='Tesla')
+        vehicle = Vehicle.objects.create(
+            user=self.user, vehicle_name='MODEL X', release_year=2019, price=500, segment=segment, brand=brand)
+        res = self.client.get(detail_url(segment.id))
+        self.assertEqual(res.data['vehicle_count'], 1)
+        res = self.client.get(reverse('api:segment-vehicles', args=[segment.id]))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in res.data['results']], [vehicle.id])
+
 #ログイン認証が通っていないユーザーに対するテスト
 class UnauthorizedSegmentApiTests(TestCase):
     def setUp(self):
@@ -3,10 +3,13 @@ from django.urls import reverse
 from django.test import TestCase
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Brand
+from .models import Brand, Segment, Vehicle
 from .serializers import BrandSerializer
+from unittest import mock
+from . import upsert
 
 BRANDS_URL = '/api/brands/'
+UPSERT_URL = '/api/brands/upsert/'
 
 #brandを作るための関数
 def create_brand(brand_name):
@@ -17,6 +20,16 @@ def detail_url(brand_id):
     return reverse('api:brand-detail', args=[brand_id])
 
 
+def brand_vehicles_url(brand_id):
+    return reverse('api:brand-vehicles', args=[brand_id])
+
+
+def create_vehicle(user, brand):
+    segment, _ = Segment.objects.get_or_create(segment_name='Sedan')
+    return Vehicle.objects.create(
+        user=user, vehicle_name='MODEL S', release_year=2019, price=500, segment=segment, brand=brand)
+
+
 class AuthorizedBrandApiTests(TestCase):
 
     def setUp(self):
@@ -86,6 +99,83 @@ class AuthorizedBrandApiTests(TestCase):
         self.client.delete(url)
         self.assertEqual(0, Brand.objects.count())
 
+    #一覧にbrandごとのvehicle数が入っているか
+    def test_3_9_should_get_brands_with_vehicle_count(self):
+        tesla = create_brand(brand_name="Tesla")
+        create_brand(brand_name="Audi")
+        create_vehicle(self.user, tesla)
+        create_vehicle(self.user, tesla)
+        res = self.client.get(BRANDS_URL)
+        counts = {brand['brand_name']: brand['vehicle_count'] for brand in res.data}
+        self.assertEqual(counts, {'Tesla': 2, 'Audi': 0})
+
+    #/api/brands/{id}/vehicles/でそのbrandのvehicleだけがページングされて返るか
+    def test_3_10_should_get_vehicles_of_brand(self):
+        tesla = create_brand(brand_name="Tesla")
+        audi = create_brand(brand_name="Audi")
+        vehicles = [create_vehicle(self.user, tesla) for _ in range(3)]
+        create_vehicle(self.user, audi)
+        res = self.client.get(brand_vehicles_url(tesla.id), {'page_size': 2})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual([v['id'] for v in res.data['results']], [v.id for v in vehicles[:2]])
+        res = self.client.get(res.data['next'])
+        self.assertEqual([v['id'] for v in res.data['results']], [vehicles[2].id])
+
+    def test_3_11_should_not_get_vehicles_of_missing_brand(self):
+        res = self.client.get(brand_vehicles_url(9999))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    #同じ名前のbrandは作成できないか
+    def test_3_12_should_not_create_duplicate_brand(self):
+        create_brand(brand_name="Tesla")
+        res = self.client.post(BRANDS_URL, {'brand_name': 'Tesla'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    #名前でbrandを取得できるか
+    def test_3_13_should_get_brand_by_name(self):
+        brand = create_brand(brand_name="Tesla")
+        res = self.client.get(reverse('api:brand-by-name', args=['Tesla']))
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['id'], brand.id)
+        res = self.client.get(reverse('api:brand-by-name', args=['Audi']))
+        self.assertEqual(res.status_code, status.HTTP_404_NOT_FOUND)
+
+    #upsertで、既存の名前はそのidが、新しい名前は作成されたidが返るか
+    def test_3_14_should_upsert_brands(self):
+        tesla = create_brand(brand_name="Tesla")
+        res = self.client.post(UPSERT_URL, {'names': ['Tesla', 'Audi', 'Audi']}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        audi = Brand.objects.get(brand_name='Audi')
+        self.assertEqual(res.data, {'Tesla': tesla.id, 'Audi': audi.id})
+        self.assertEqual(2, Brand.objects.count())
+
+    def test_3_15_should_not_upsert_empty_names(self):
+        res = self.client.post(UPSERT_URL, {'names': []}, format='json')
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    #新しい名前を作成したときだけ、キャッシュを無効にしてcreatedのイベントを送るか
+    def test_3_16_should_invalidate_only_when_created(self):
+        tesla = create_brand(brand_name="Tesla")
+        with mock.patch.object(upsert, 'bump_table_version') as bump, \
+                mock.patch.object(upsert, 'publish_on_commit') as publish:
+            upsert.upsert_names(Brand, 'brand_name', ['Tesla'])
+            bump.assert_not_called()
+            publish.assert_not_called()
+            ids = upsert.upsert_names(Brand, 'brand_name', ['Tesla', 'Audi'])
+        self.assertEqual(ids['Tesla'], tesla.id)
+        bump.assert_called_once_with(Brand)
+        publish.assert_called_once_with(Brand, 'created', ids['Audi'])
+
+    #RETURNINGが使えないDBでも同じ結果になるか
+    def test_3_17_should_upsert_without_returning(self):
+        tesla = create_brand(brand_name="Tesla")
+        with mock.patch.object(upsert, '_supports_returning_upsert', return_value=False), \
+                mock.patch.object(upsert, 'publish_on_commit') as publish:
+            ids = upsert.upsert_names(Brand, 'brand_name', ['Tesla', 'Audi'])
+        audi = Brand.objects.get(brand_name='Audi')
+        self.assertEqual(ids, {'Tesla': tesla.id, 'Audi': audi.id})
+        publish.assert_called_once_with(Brand, 'created', audi.id)
+
 #tokenの認証が通っていない場合のtest
 class UnauthorizedBrandApiTests(TestCase):
 
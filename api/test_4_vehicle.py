@@ -1,15 +1,26 @@
 from django.contrib.auth import get_user_model
 from django.urls import reverse
-from django.test import TestCase
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.db import connection, transaction, IntegrityError
+from concurrent.futures import ThreadPoolExecutor
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Vehicle, Brand, Segment
-from .serializers import VehicleSerializer
+from .models import Vehicle, Brand, Segment, ArchivedVehicle
+from django.core.management import call_command, CommandError
+from io import BytesIO, StringIO
+from django.core.handlers.asgi import ASGIRequest
+from .serializers import VehicleSerializer, brand_cache
+from . import group_commit
+from .group_commit import GroupCommitBuffer
+from .views import vehicle_list_cache
 from decimal import Decimal
+from unittest import mock
+from . import cache
 
 SEGMENTS_URL = '/api/segments/'
 BRANDS_URL = '/api/brands/'
 VEHICLES_URL = '/api/vehicles/'
+MY_VEHICLES_URL = '/api/vehicles/mine/'
 
 
 def create_segment(segment_name):
@@ -50,6 +61,8 @@ class AuthorizedVehicleApiTests(TestCase):
         self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
         self.client = APIClient()
         self.client.force_authenticate(self.user)
+        #TestCaseではcommitされずテーブルのバージョンが上がらないので、前のテストの一覧のキャッシュを消しておく
+        vehicle_list_cache.clear()
     
     #getメソッドでvehicleの一覧を取得できるか
     def test_4_1_should_get_vehicles(self):
@@ -178,6 +191,140 @@ class AuthorizedVehicleApiTests(TestCase):
         self.client.delete(url)
         self.assertEqual(0, Vehicle.objects.count())
 
+    #mineでは自分が登録したvehicleだけが返るか
+    def test_4_11_should_get_only_my_vehicles(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        other = get_user_model().objects.create_user(username='other', password='other_pw')
+        mine = create_vehicle(user=self.user, segment=segment, brand=brand)
+        create_vehicle(user=other, segment=segment, brand=brand)
+        res = self.client.get(MY_VEHICLES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['results'], VehicleSerializer([mine], many=True).data)
+
+    #mineがキーセットでページングされるか
+    def test_4_12_should_paginate_my_vehicles_by_cursor(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        for _ in range(3):
+            create_vehicle(user=self.user, segment=segment, brand=brand)
+        res = self.client.get(MY_VEHICLES_URL, {'page_size': 2})
+        self.assertEqual(len(res.data['results']), 2)
+        self.assertIsNotNone(res.data['next'])
+        res = self.client.get(res.data['next'])
+        self.assertEqual(len(res.data['results']), 1)
+        self.assertIsNone(res.data['next'])
+
+    #他人のvehicleは参照できるが、更新・削除はできないか
+    def test_4_13_should_not_modify_others_vehicle(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        other = get_user_model().objects.create_user(username='other', password='other_pw')
+        vehicle = create_vehicle(user=other, segment=segment, brand=brand)
+        url = detail_vehicle_url(vehicle.id)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_200_OK)
+        res = self.client.patch(url, {'vehicle_name': 'MODEL X'})
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        res = self.client.delete(url)
+        self.assertEqual(res.status_code, status.HTTP_403_FORBIDDEN)
+        self.assertEqual(1, Vehicle.objects.count())
+
+    #古いvehicleだけがバッチに分けてアーカイブされるか(--max-batchesで止めて再実行しても続きから移せるか)
+    def test_4_19_should_archive_old_vehicles_in_batches(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        old = [create_vehicle(user=self.user, segment=segment, brand=brand, release_year=2000) for _ in range(3)]
+        new = create_vehicle(user=self.user, segment=segment, brand=brand, release_year=2020)
+        call_command('archive_vehicles', cutoff_year=2010, batch_size=2, max_batches=1, stdout=StringIO())
+        self.assertEqual(2, ArchivedVehicle.objects.count())
+        call_command('archive_vehicles', cutoff_year=2010, batch_size=2, stdout=StringIO())
+        self.assertEqual(sorted(ArchivedVehicle.objects.values_list('id', flat=True)), [v.id for v in old])
+        self.assertEqual(list(Vehicle.objects.values_list('id', flat=True)), [new.id])
+
+    #同じidがすでにアーカイブにある場合は、バッチ全体がrollbackされて元のvehicleが消えないか
+    def test_4_26_should_not_delete_vehicles_when_archive_conflicts(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        vehicles = [create_vehicle(user=self.user, segment=segment, brand=brand, release_year=2000) for _ in range(2)]
+        ArchivedVehicle.objects.create(
+            id=vehicles[1].id, user=self.user, vehicle_name='MODEL T', release_year=1990, price=100,
+            segment=segment, brand=brand)
+        with self.assertRaises(CommandError):
+            call_command('archive_vehicles', cutoff_year=2010, stdout=StringIO())
+        self.assertEqual(2, Vehicle.objects.count())
+        self.assertEqual(list(ArchivedVehicle.objects.values_list('vehicle_name', flat=True)), ['MODEL T'])
+
+    #アーカイブ済みのvehicleは?include_archived=1のときだけ返るか
+    def test_4_20_should_include_archived_only_when_asked(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        old = create_vehicle(user=self.user, segment=segment, brand=brand, release_year=2000)
+        new = create_vehicle(user=self.user, segment=segment, brand=brand, release_year=2020)
+        call_command('archive_vehicles', cutoff_year=2010, stdout=StringIO())
+        res = self.client.get(VEHICLES_URL)
+        self.assertEqual([v['id'] for v in res.data], [new.id])
+        res = self.client.get(VEHICLES_URL, {'include_archived': 1})
+        self.assertEqual([v['id'] for v in res.data['results']], [old.id, new.id])
+        self.assertEqual(res.data['results'][0]['brand_name'], 'Tesla')
+        self.assertEqual(res.data['results'][0]['price'], str(old.price))
+        self.assertIsNone(res.data['next'])
+        url = detail_vehicle_url(old.id)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_404_NOT_FOUND)
+        res = self.client.get(url, {'include_archived': 1})
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['vehicle_name'], old.vehicle_name)
+
+    #セント単位で保存しても、priceは今まで通りの文字列で返るか
+    def test_4_21_should_keep_price_format(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        for price, expected in [(500.12, '500.12'), (500, '500.00'), (0.05, '0.05'), (9999.99, '9999.99')]:
+            vehicle = create_vehicle(user=self.user, segment=segment, brand=brand, price=price)
+            res = self.client.get(detail_vehicle_url(vehicle.id))
+            self.assertEqual(res.data['price'], expected)
+            self.assertEqual(vehicle.price, Decimal(expected))
+
+    #?min_price=、?max_price=で絞り込めるか
+    def test_4_22_should_filter_vehicles_by_price_range(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        for price in (100, 200.5, 300):
+            create_vehicle(user=self.user, segment=segment, brand=brand, price=price)
+        res = self.client.get(VEHICLES_URL, {'min_price': '200.50', 'max_price': '300'})
+        self.assertEqual([v['price'] for v in res.data], ['200.50', '300.00'])
+        res = self.client.get(VEHICLES_URL, {'min_price': 'abc'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    #桁数が多すぎるpriceはエラーになるか
+    def test_4_23_should_not_create_vehicle_with_invalid_price(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        payload = {
+            'vehicle_name': 'MODEL S',
+            'release_year': 2019,
+            'price': '10000.00',
+            'segment': segment.id,
+            'brand': brand.id,
+        }
+        res = self.client.post(VEHICLES_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    #?include_archived=1の一覧は、vehicleとアーカイブをidの順にまとめてページごとに返すか
+    def test_4_29_should_paginate_archived_list_by_id(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        ids = [create_vehicle(user=self.user, segment=segment, brand=brand, release_year=year, price=year).id
+               for year in (2000, 2020, 2001, 2021, 2002)]
+        call_command('archive_vehicles', cutoff_year=2010, stdout=StringIO())
+        res = self.client.get(VEHICLES_URL, {'include_archived': 1, 'page_size': 2, 'min_price': 2001})
+        self.assertEqual([v['id'] for v in res.data['results']], ids[1:3])
+        res = self.client.get(res.data['next'])
+        self.assertEqual([v['id'] for v in res.data['results']], ids[3:])
+        self.assertEqual(res.data['results'][0]['segment_name'], 'Sedan')
+        self.assertIsNone(res.data['next'])
+        res = self.client.get(VEHICLES_URL, {'include_archived': 1, 'after': 'x'})
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class UnauthorizedVehicleApiTests(TestCase):
 
@@ -186,4 +333,162 @@ class UnauthorizedVehicleApiTests(TestCase):
 
     def test_4__10_should_not_get_vehicles_when_unauthorized(self):
         res = self.client.get(VEHICLES_URL)
-        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
\ No newline at end of file
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+#segment、brandのキャッシュのテスト
+#キャッシュはcommitされた行だけを持ち、commitされてからバージョンが上がるので、TransactionTestCaseを使う
+class FkCacheVehicleTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    #キャッシュが温まっていれば、POSTでsegment、brandのSELECTが発生しないか
+    def test_4_14_should_validate_fk_without_query(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        payload = {
+            'vehicle_name': 'MODEL S',
+            'release_year': 2019,
+            'price': 500.12,
+            'segment': segment.id,
+            'brand': brand.id,
+        }
+        self.client.post(VEHICLES_URL, payload)
+        #INSERTの1クエリのみ
+        with self.assertNumQueries(1):
+            res = self.client.post(VEHICLES_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(res.data['brand_name'], 'Tesla')
+
+    #brandの変更・削除がキャッシュに反映されるか
+    def test_4_15_should_invalidate_fk_cache_on_change(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        payload = {
+            'vehicle_name': 'MODEL S',
+            'release_year': 2019,
+            'price': 500.12,
+            'segment': segment.id,
+            'brand': brand.id,
+        }
+        self.client.post(VEHICLES_URL, payload)
+        brand.brand_name = 'Tesla Motors'
+        brand.save()
+        res = self.client.post(VEHICLES_URL, payload)
+        self.assertEqual(res.data['brand_name'], 'Tesla Motors')
+        brand.delete()
+        res = self.client.post(VEHICLES_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+
+    #rollbackされたbrandがキャッシュに残らないか
+    def test_4_24_should_not_cache_rolled_back_rows(self):
+        with self.assertRaises(RuntimeError):
+            with transaction.atomic():
+                brand = create_brand(brand_name='Tesla')
+                self.assertEqual(brand_cache.get(brand.id), brand)
+                raise RuntimeError
+        self.assertIsNone(brand_cache.get(brand.id))
+
+    #get_manyは、キャッシュにないidもまとめて1クエリで確認するか
+    def test_4_25_should_get_many_with_one_query(self):
+        brands = [create_brand(brand_name='Brand %d' % i) for i in range(3)]
+        brand_cache.get(brands[0].id)
+        Brand.objects.bulk_create([Brand(brand_name='Brand 3'), Brand(brand_name='Brand 4')])
+        new_ids = list(Brand.objects.filter(brand_name__in=['Brand 3', 'Brand 4']).values_list('id', flat=True))
+        ids = [brand.id for brand in brands] + new_ids + [0]
+        with self.assertNumQueries(1):
+            found = brand_cache.get_many(ids)
+        self.assertEqual(sorted(found), sorted(ids[:-1]))
+
+
+    #ほかのプロセスで削除されたbrandがキャッシュに残っていても、500ではなく400になり、キャッシュから消えるか
+    def test_4_27_should_reject_brand_deleted_by_another_process(self):
+        segment = create_segment(segment_name='Sedan')
+        brand = create_brand(brand_name='Tesla')
+        payload = {
+            'vehicle_name': 'MODEL S',
+            'release_year': 2019,
+            'price': 500.12,
+            'segment': segment.id,
+            'brand': brand.id,
+        }
+        self.client.post(VEHICLES_URL, payload)
+        #キャッシュを共有していないプロセスでの削除と同じように、このプロセスのバージョンは上がらない
+        brand_id = brand.id
+        with mock.patch.object(cache, '_incr_table_version'):
+            brand.delete()
+        self.assertIsNotNone(brand_cache.get(brand_id))
+        res = self.client.post(VEHICLES_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('brand', res.data)
+        self.assertIsNone(brand_cache.get(brand_id))
+
+#group commitのテスト
+#スレッドごとに別のDB接続を使うため、TransactionTestCaseを使う
+@override_settings(VEHICLE_GROUP_COMMIT={'ENABLED': True, 'MAX_DELAY_MS': 1000, 'MAX_ROWS': 4})
+class GroupCommitVehicleTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.segment = create_segment(segment_name='Sedan')
+        self.brand = create_brand(brand_name='Tesla')
+
+    def submit_concurrently(self, buffer, vehicles):
+        def submit(vehicle):
+            try:
+                return buffer.submit(vehicle)
+            except IntegrityError as exc:
+                return exc
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(len(vehicles)) as pool:
+            return list(pool.map(submit, vehicles))
+
+    def build_vehicle(self, **params):
+        defaults = {'vehicle_name': 'MODEL S', 'release_year': 2019, 'price': 500.00}
+        defaults.update(params)
+        return Vehicle(user=self.user, segment=self.segment, brand=self.brand, **defaults)
+
+    #同時に来た4件がまとめて書き込まれ、それぞれにidが返るか
+    def test_4_16_should_group_concurrent_creates(self):
+        vehicles = [self.build_vehicle(vehicle_name='MODEL %d' % i) for i in range(4)]
+        results = self.submit_concurrently(GroupCommitBuffer(Vehicle), vehicles)
+        self.assertEqual(len({vehicle.id for vehicle in results}), 4)
+        self.assertEqual(4, Vehicle.objects.count())
+
+    #1件だけエラーになった場合、その呼び出し元にだけエラーが返るか
+    def test_4_17_should_return_error_only_to_failed_caller(self):
+        vehicles = [self.build_vehicle() for _ in range(3)] + [self.build_vehicle(vehicle_name=None)]
+        results = self.submit_concurrently(GroupCommitBuffer(Vehicle), vehicles)
+        self.assertIsInstance(results[3], IntegrityError)
+        self.assertTrue(all(isinstance(vehicle, Vehicle) for vehicle in results[:3]))
+        self.assertEqual(3, Vehicle.objects.count())
+
+    #group commitが有効でもPOSTのレスポンスは今まで通りか
+    @override_settings(VEHICLE_GROUP_COMMIT={'ENABLED': True, 'MAX_DELAY_MS': 1, 'MAX_ROWS': 100})
+    def test_4_18_should_create_vehicle_with_group_commit(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        payload = {
+            'vehicle_name': 'MODEL S',
+            'release_year': 2019,
+            'price': 500.12,
+            'segment': self.segment.id,
+            'brand': self.brand.id,
+        }
+        res = client.post(VEHICLES_URL, payload)
+        self.assertEqual(res.status_code, status.HTTP_201_CREATED)
+        vehicle = Vehicle.objects.get(id=res.data['id'])
+        self.assertEqual(vehicle.user, self.user)
+        self.assertEqual(res.data['brand_name'], 'Tesla')
+
+    #ASGIのリクエストでは、ENABLEDでもgroup commitを使わないか
+    @override_settings(VEHICLE_GROUP_COMMIT={'ENABLED': True, 'MAX_DELAY_MS': 1, 'MAX_ROWS': 100})
+    def test_4_28_should_not_group_commit_under_asgi(self):
+        scope = {'type': 'http', 'method': 'POST', 'path': VEHICLES_URL, 'headers': [], 'query_string': b''}
+        self.assertFalse(group_commit.is_enabled(ASGIRequest(scope, BytesIO())))
+        self.assertTrue(group_commit.is_enabled(RequestFactory().post(VEHICLES_URL)))
@@ -0,0 +1,30 @@
+from django.test import TestCase
+from rest_framework import status
+from rest_framework.test import APIClient
+from rest_api import warmup
+
+READY_URL = '/ready/'
+
+
+class ReadinessTests(TestCase):
+
+    def setUp(self):
+        self.client = APIClient()
+        self.saved = dict(warmup.state)
+        warmup.state['ready'] = False
+
+    def tearDown(self):
+        warmup.state.update(self.saved)
+
+    #warm-up前は503が返るか
+    def test_5_1_should_not_be_ready_before_warm_up(self):
+        res = self.client.get(READY_URL)
+        self.assertEqual(res.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+
+    #warm-up後は200とかかった時間が返るか
+    def test_5_2_should_be_ready_after_warm_up(self):
+        warmup.warm_up()
+        res = self.client.get(READY_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertTrue(res.json()['ready'])
+        self.assertIsNotNone(res.json()['warmup_seconds'])
@@ -0,0 +1,38 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework import status
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+VEHICLES_URL = '/api/vehicles/'
+ADMIN_LOGIN_URL = '/admin/login/'
+
+
+#API向けの軽量なmiddleware構成でのテスト
+@override_settings(MIDDLEWARE=settings.API_MIDDLEWARE)
+class ApiMiddlewareProfileTests(TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+
+    #tokenでの認証は今まで通り通るか
+    def test_6_1_should_authenticate_api_with_token(self):
+        token = Token.objects.create(user=self.user)
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + token.key)
+        res = self.client.get(VEHICLES_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        #/api/ではclickjackingのmiddlewareが動かない
+        self.assertNotIn('X-Frame-Options', res)
+
+    def test_6_2_should_reject_api_without_token(self):
+        res = self.client.get(VEHICLES_URL)
+        self.assertEqual(res.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    #/admin/ではsessionやcsrfなど全てのmiddlewareが動くか
+    def test_6_3_should_keep_full_stack_for_admin(self):
+        res = self.client.get(ADMIN_LOGIN_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res['X-Frame-Options'], 'DENY')
+        self.assertIn(settings.CSRF_COOKIE_NAME, res.cookies)
@@ -0,0 +1,74 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import TestCase, override_settings
+from rest_framework.test import APIClient
+from .budgets import QueryBudgetTestMixin, QueryBudgetExceeded
+from .models import Vehicle, Brand, Segment
+from .views import VehicleViewSet, ProfileUserView, BrandViewSet
+
+VEHICLES_URL = '/api/vehicles/'
+MY_VEHICLES_URL = '/api/vehicles/mine/'
+PROFILE_URL = '/api/profile/'
+BRANDS_URL = '/api/brands/'
+
+
+#一覧のキャッシュが効くとクエリが発生せず予算をチェックできないので、キャッシュを無効にする
+@override_settings(VEHICLE_LIST_CACHE={'ENABLED': False})
+class QueryBudgetTests(QueryBudgetTestMixin, TestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    #vehicleをsize件になるまで追加する(brand、segmentも毎回別のものを作る)
+    def populate_vehicles(self, size):
+        for i in range(Vehicle.objects.count(), size):
+            Vehicle.objects.create(
+                user=self.user, vehicle_name='MODEL %d' % i, release_year=2019, price=500,
+                segment=Segment.objects.create(segment_name='Segment %d' % i),
+                brand=Brand.objects.create(brand_name='Brand %d' % i),
+            )
+
+    #件数が増えてもvehicle一覧のクエリ数が増えないか
+    def test_7_1_vehicle_list_should_be_within_budget(self):
+        self.assertWithinQueryBudget(
+            VehicleViewSet, 'list', lambda: self.client.get(VEHICLES_URL), self.populate_vehicles)
+
+    def test_7_2_my_vehicles_should_be_within_budget(self):
+        self.assertWithinQueryBudget(
+            VehicleViewSet, 'mine', lambda: self.client.get(MY_VEHICLES_URL), self.populate_vehicles)
+
+    def test_7_3_profile_should_be_within_budget(self):
+        self.assertWithinQueryBudget(
+            ProfileUserView, 'retrieve', lambda: self.client.get(PROFILE_URL), lambda size: None)
+
+    #brandの数が増えてもvehicle_countのためのクエリが増えないか
+    def test_7_6_brand_list_should_be_within_budget(self):
+        self.assertWithinQueryBudget(
+            BrandViewSet, 'list', lambda: self.client.get(BRANDS_URL), self.populate_vehicles)
+
+    #実行時チェック: 'raise'では予算を超えたリクエストがエラーになり、SQLとstackが付いているか
+    @override_settings(QUERY_BUDGET_MODE='raise')
+    def test_7_4_should_raise_when_budget_exceeded(self):
+        self.populate_vehicles(1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch.object(VehicleViewSet, 'query_budgets', {'list': 0}):
+            with self.assertRaises(QueryBudgetExceeded) as ctx:
+                client.get(VEHICLES_URL)
+        sql, stack = ctx.exception.queries[0]
+        self.assertIn('api_vehicle', sql)
+        self.assertIsNotNone(stack)
+
+    #'log'ではエラーにせずwarningを出すか
+    @override_settings(QUERY_BUDGET_MODE='log')
+    def test_7_5_should_log_when_budget_exceeded(self):
+        self.populate_vehicles(1)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        with mock.patch.object(VehicleViewSet, 'query_budgets', {'list': 0}):
+            with self.assertLogs('api.budgets', 'WARNING'):
+                res = client.get(VEHICLES_URL)
+        self.assertEqual(res.status_code, 200)
@@ -0,0 +1,86 @@
+import time
+from unittest import mock, skipIf
+
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase
+from rest_framework import status
+from rest_framework.test import APIClient
+from . import analytics, cache
+from .models import Vehicle, Brand, Segment
+
+STATS_URL = '/api/vehicles/stats/'
+
+
+#集計のキャッシュはcommitされてから無効になるので、TransactionTestCaseを使う
+class PriceAnalyticsTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.sedan = Segment.objects.create(segment_name='Sedan')
+        self.suv = Segment.objects.create(segment_name='SUV')
+        self.tesla = Brand.objects.create(brand_name='Tesla')
+        self.audi = Brand.objects.create(brand_name='Audi')
+        for price, year, segment, brand in [
+            (100, 2019, self.sedan, self.tesla),
+            (200, 2019, self.sedan, self.audi),
+            (300, 2020, self.suv, self.tesla),
+            (400, 2020, self.suv, self.tesla),
+        ]:
+            self.create_vehicle(price, year, segment, brand)
+
+    def create_vehicle(self, price, year, segment, brand):
+        return Vehicle.objects.create(
+            user=self.user, vehicle_name='MODEL S', release_year=year, price=price,
+            segment=segment, brand=brand,
+        )
+
+    #分位点、release_year別、brand別の集計が正しいか
+    def test_8_1_should_get_price_stats(self):
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.status_code, status.HTTP_200_OK)
+        self.assertEqual(res.data['count'], 4)
+        self.assertEqual(res.data['price']['mean'], 250.0)
+        self.assertEqual(res.data['price']['quantiles']['p50'], 250.0)
+        self.assertEqual(res.data['price']['quantiles']['p25'], 175.0)
+        self.assertEqual(res.data['by_release_year'], [
+            {'release_year': 2019, 'count': 2, 'mean': 150.0, 'median': 150.0, 'min': 100.0, 'max': 200.0},
+            {'release_year': 2020, 'count': 2, 'mean': 350.0, 'median': 350.0, 'min': 300.0, 'max': 400.0},
+        ])
+        self.assertEqual(res.data['by_brand'][0], {
+            'brand': self.tesla.id, 'count': 3, 'mean': 266.67, 'median': 300.0, 'min': 100.0, 'max': 400.0,
+        })
+
+    #vehicleが追加されたらキャッシュが無効になり、再計算されるか
+    def test_8_2_should_recompute_after_vehicle_change(self):
+        self.client.get(STATS_URL)
+        self.create_vehicle(500, 2021, self.sedan, self.audi)
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['count'], 5)
+
+    #chunkに分けて取得しても、numpyとpythonで結果が一致するか
+    @skipIf(analytics.np is None, 'numpy is not installed')
+    def test_8_3_numpy_and_python_should_agree(self):
+        self.create_vehicle(123.45, 2018, self.suv, self.audi)
+        numpy_stats = analytics.compute_price_stats(
+            analytics.fetch_columns(chunk_size=2, use_numpy=True), use_numpy=True)
+        python_stats = analytics.compute_price_stats(
+            analytics.fetch_columns(chunk_size=2, use_numpy=False), use_numpy=False)
+        self.assertEqual(numpy_stats, python_stats)
+
+    def test_8_4_should_handle_empty_table(self):
+        Vehicle.objects.all().delete()
+        res = self.client.get(STATS_URL)
+        self.assertEqual(res.data['count'], 0)
+
+    #集計結果は期限付きでキャッシュされ、期限が切れたら計算し直されるか
+    def test_8_5_should_expire_cached_stats(self):
+        with mock.patch.object(analytics, 'STATS_CACHE_SECONDS', 1):
+            self.client.get(STATS_URL)
+            #バージョンを上げずに行を増やす(キャッシュを共有していないプロセスでの変更と同じ)
+            with mock.patch.object(cache, '_incr_table_version'):
+                self.create_vehicle(500, 2021, self.sedan, self.audi)
+            self.assertEqual(self.client.get(STATS_URL).data['count'], 4)
+            time.sleep(1.1)
+            self.assertEqual(self.client.get(STATS_URL).data['count'], 5)
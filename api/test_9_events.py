@@ -0,0 +1,152 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.test import TransactionTestCase, override_settings
+from rest_framework.authtoken.models import Token
+from .events import broker, event_stream
+from .models import Brand
+
+
+def make_scope(token=None, last_event_id=None):
+    headers = []
+    if token is not None:
+        headers.append((b'authorization', ('Token ' + token).encode()))
+    if last_event_id is not None:
+        headers.append((b'last-event-id', str(last_event_id).encode()))
+    return {'type': 'http', 'path': '/api/events/', 'headers': headers, 'query_string': b''}
+
+
+#ASGIアプリを直接呼び出し、送られたイベントを集めるクライアント
+class StreamClient:
+
+    def __init__(self, scope):
+        self.scope = scope
+        self.messages = []
+        self.closed = asyncio.Event()
+
+    async def receive(self):
+        await self.closed.wait()
+        return {'type': 'http.disconnect'}
+
+    async def send(self, message):
+        self.messages.append(message)
+
+    def start(self):
+        self.task = asyncio.ensure_future(event_stream(self.scope, self.receive, self.send))
+
+    async def wait_for(self, count):
+        for _ in range(200):
+            if len(self.events()) >= count:
+                return self.events()
+            await asyncio.sleep(0.01)
+        return self.events()
+
+    async def close(self):
+        self.closed.set()
+        await self.task
+
+    def events(self):
+        events = []
+        for message in self.messages[1:]:
+            body = message.get('body', b'').decode()
+            if body.startswith('id:'):
+                fields = dict(line.split(': ', 1) for line in body.strip().split('\n'))
+                fields['data'] = json.loads(fields['data'])
+                events.append(fields)
+        return events
+
+
+#signalsからのイベントがcommit後に送られるので、TransactionTestCaseを使う
+class EventStreamTests(TransactionTestCase):
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username='dummy', password='dummy_pw')
+        self.token = Token.objects.create(user=self.user).key
+
+    #tokenがなければ401が返るか
+    def test_9_1_should_reject_without_token(self):
+        async def scenario():
+            client = StreamClient(make_scope())
+            client.start()
+            await client.task
+            return client.messages[0]['status']
+
+        self.assertEqual(asyncio.run(scenario()), 401)
+
+    #brandを作成するとイベントが届くか
+    def test_9_2_should_stream_model_changes(self):
+        async def scenario():
+            client = StreamClient(make_scope(self.token))
+            client.start()
+            await asyncio.sleep(0.1)
+            brand = await sync_to_async(Brand.objects.create)(brand_name='Tesla')
+            events = await client.wait_for(1)
+            await client.close()
+            return client.messages[0], events, brand
+
+        start, events, brand = asyncio.run(scenario())
+        self.assertEqual(start['status'], 200)
+        self.assertEqual(events[0]['event'], 'brand.created')
+        self.assertEqual(events[0]['data'], {'model': 'brand', 'action': 'created', 'id': brand.id})
+
+    #Last-Event-IDで、切断中に起きたイベントから再開できるか
+    def test_9_3_should_resume_from_last_event_id(self):
+        async def scenario():
+            broker.publish('vehicle', 'created', 1)
+            last_id = broker._last_id
+            broker.publish('vehicle', 'updated', 1)
+            broker.publish('vehicle', 'deleted', 1)
+            client = StreamClient(make_scope(self.token, last_event_id=last_id))
+            client.start()
+            events = await client.wait_for(2)
+            await client.close()
+            return events
+
+        events = asyncio.run(scenario())
+        self.assertEqual([event['event'] for event in events], ['vehicle.updated', 'vehicle.deleted'])
+
+    #履歴にないLast-Event-IDの場合はresetが送られるか
+    def test_9_4_should_reset_when_history_is_missing(self):
+        async def scenario():
+            client = StreamClient(make_scope(self.token, last_event_id=broker._last_id + 100))
+            client.start()
+            events = await client.wait_for(1)
+            await client.close()
+            return events
+
+        events = asyncio.run(scenario())
+        self.assertEqual(events[0]['event'], 'reset')
+
+    #切断中のイベントがバッファより多い場合は、再接続を繰り返さずにresetが送られるか
+    @override_settings(EVENT_STREAM={'BUFFER_SIZE': 100})
+    def test_9_5_should_reset_when_gap_exceeds_buffer(self):
+        async def scenario():
+            last_id = broker._last_id
+            for pk in range(150):
+                broker.publish('vehicle', 'created', pk)
+            client = StreamClient(make_scope(self.token, last_event_id=last_id))
+            client.start()
+            events = await client.wait_for(1)
+            await client.close()
+            return events
+
+        events = asyncio.run(scenario())
+        self.assertEqual([event['event'] for event in events], ['reset'])
+        self.assertEqual(int(events[0]['id']), broker._last_id)
+
+    #バッファがあふれても、溜まっていたイベントを送ってから接続を終えるか
+    @override_settings(EVENT_STREAM={'BUFFER_SIZE': 2})
+    def test_9_6_should_drain_queue_before_closing_on_overflow(self):
+        async def scenario():
+            client = StreamClient(make_scope(self.token))
+            client.start()
+            await asyncio.sleep(0.1)
+            for pk in range(5):
+                broker.publish('vehicle', 'created', pk)
+            await asyncio.wait_for(client.task, 2)
+            return client.events()
+
+        events = asyncio.run(scenario())
+        self.assertEqual([event['data']['id'] for event in events], [0, 1])
@@ -0,0 +1,66 @@
+from django.db import connection, transaction
+
+from .cache import bump_table_version
+from .signals import publish_on_commit
+
+#sqliteの変数の上限(999)を超えないように分けて実行する
+BATCH_SIZE = 500
+
+
+def _supports_returning_upsert():
+    if connection.vendor == 'postgresql':
+        return True
+    #sqliteはRETURNINGが3.35から
+    return connection.vendor == 'sqlite' and connection.Database.sqlite_version_info >= (3, 35)
+
+
+#名前のリストを{名前: id}に変換する。存在しない名前は作成する
+#INSERT ... ON CONFLICT DO NOTHING RETURNINGで、作成した行のidだけを受け取り、既存の名前のidはSELECTで取得する
+#既存の行は更新もロックもしない。名前にユニーク制約があるので、同時に実行されても重複は作られない
+def upsert_names(model, field, names):
+    names = list(dict.fromkeys(names))
+    ids = {}
+    created = {}
+    with transaction.atomic():
+        for start in range(0, len(names), BATCH_SIZE):
+            batch = names[start:start + BATCH_SIZE]
+            if _supports_returning_upsert():
+                inserted = _insert_returning(model, field, batch)
+            else:
+                inserted = _insert_ignoring_conflicts(model, field, batch)
+            created.update(inserted)
+            ids.update(inserted)
+            rest = [name for name in batch if name not in inserted]
+            if rest:
+                ids.update(model.objects.filter(**{field + '__in': rest}).values_list(field, 'id'))
+    #raw SQLやbulk_createではsignalsが飛ばないので、行を作成した場合だけキャッシュ用のバージョンを上げ、イベントを送る
+    #(すべて既存の名前なら、キャッシュは無効にしない)
+    if created:
+        bump_table_version(model)
+        for pk in created.values():
+            publish_on_commit(model, 'created', pk)
+    return {name: ids[name] for name in names}
+
+
+#作成した行の{名前: id}を返す(既存の名前は含まれない)
+def _insert_returning(model, field, names):
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    column = qn(model._meta.get_field(field).column)
+    pk = qn(model._meta.pk.column)
+    sql = 'INSERT INTO %s (%s) VALUES %s ON CONFLICT (%s) DO NOTHING RETURNING %s, %s' % (
+        table, column, ', '.join(['(%s)'] * len(names)), column, column, pk,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, names)
+        return dict(cursor.fetchall())
+
+
+#RETURNINGが使えないDB用。先に既存の名前を調べ、なかったものだけを作成する
+def _insert_ignoring_conflicts(model, field, names):
+    existing = set(model.objects.filter(**{field + '__in': names}).values_list(field, flat=True))
+    missing = [name for name in names if name not in existing]
+    if not missing:
+        return {}
+    model.objects.bulk_create([model(**{field: name}) for name in missing], ignore_conflicts=True)
+    return dict(model.objects.filter(**{field + '__in': missing}).values_list(field, 'id'))
@@ -10,6 +10,7 @@ router = DefaultRouter()
 router.register('segments', views.SegmentViewSet)
 router.register('brands', views.BrandViewSet)
 router.register('vehicles', views.VehicleViewSet)
+router.register('jobs', views.JobViewSet)
 
 #app_nameにapiという名前をつける
 app_name = 'api'
@@ -1,7 +1,43 @@
-from rest_framework import generics, permissions, viewsets, status
-from .serializers import UserSerializer, SegmentSerializer, BrandSerializer, VehicleSerializer
-from .models import Segment, Brand, Vehicle
+import os
+
+from rest_framework import generics, mixins, permissions, viewsets, status
+from .serializers import UserSerializer, SegmentSerializer, BrandSerializer, VehicleSerializer, UpsertNamesSerializer
+from .serializers import CentsPriceField, JobSerializer
+from rest_framework.exceptions import NotFound, ValidationError
+from .models import Segment, Brand, Vehicle, ArchivedVehicle, Job
+from django.db import IntegrityError
+from django.db.models import Count
+from django.http import FileResponse, Http404
 from rest_framework.response import Response
+from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404
+from rest_framework.utils.urls import replace_query_param
+from .permissions import IsOwnerOrReadOnly
+from .pagination import VehicleCursorPagination
+from .analytics import get_price_stats
+from .cache import table_version
+from .upsert import upsert_names
+from . import group_commit, jobs, result_cache
+
+#group commitが有効なときにvehicleのINSERTをまとめるバッファ
+vehicle_buffer = group_commit.GroupCommitBuffer(Vehicle)
+#vehicle一覧のレスポンスのキャッシュ
+vehicle_list_cache = result_cache.ResultCache('vehicle_list')
+#?include_archived=1の一覧でUNIONする列(vehicleとアーカイブで同じ並びにする)
+ARCHIVED_LIST_FIELDS = (
+    'id', 'vehicle_name', 'release_year', 'price_cents',
+    'segment_id', 'segment__segment_name', 'brand_id', 'brand__brand_name',
+)
+
+
+#UNIONの1行を、VehicleSerializerで返せるようにVehicleのインスタンスに戻す
+def vehicle_from_row(row):
+    vehicle_id, vehicle_name, release_year, price_cents, segment_id, segment_name, brand_id, brand_name = row
+    return Vehicle(
+        id=vehicle_id, vehicle_name=vehicle_name, release_year=release_year, price_cents=price_cents,
+        segment=Segment(id=segment_id, segment_name=segment_name),
+        brand=Brand(id=brand_id, brand_name=brand_name),
+    )
 
 
 #ユーザーを新規で作成するview
@@ -17,6 +53,8 @@ class CreateUserView(generics.CreateAPIView):
 #ユーザーの情報を検索して表示
 class ProfileUserView(generics.RetrieveUpdateAPIView):
     serializer_class = UserSerializer
+    #actionごとのクエリ数の上限(token認証の1クエリを含む)。api/budgets.pyを参照
+    query_budgets = {'retrieve': 1}
 
     #ユーザー情報を取得
     def get_object(self):
@@ -36,25 +74,220 @@ class ProfileUserView(generics.RetrieveUpdateAPIView):
         return Response(response, status=status.HTTP_405_METHOD_NOT_ALLOWED)
 
 
+#segment、brandに紐づくvehicleの一覧(/api/segments/{id}/vehicles/、/api/brands/{id}/vehicles/)
+#(brand, id)などの複合インデックスとキーセットページネーションで返す
+class NestedVehiclesMixin:
+    #vehicleを絞り込むFKの名前
+    vehicle_filter = None
+
+    @action(detail=True, methods=['get'], pagination_class=VehicleCursorPagination)
+    def vehicles(self, request, pk=None):
+        #存在しないidの場合は404
+        parent = self.get_object()
+        queryset = Vehicle.objects.select_related('segment', 'brand').filter(**{self.vehicle_filter: parent})
+        page = self.paginate_queryset(queryset)
+        serializer = VehicleSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
+
+
+#名前(ユニーク)でのsegment、brandの取得とupsert
+#GET /api/brands/name/{brand_name}/、POST /api/brands/upsert/ {"names": [...]} -> {名前: id}
+class NaturalKeyMixin:
+    #名前のフィールド
+    name_field = None
+
+    @action(detail=False, methods=['get'], url_path=r'name/(?P<name>[^/]+)')
+    def by_name(self, request, name=None):
+        instance = get_object_or_404(self.get_queryset(), **{self.name_field: name})
+        return Response(self.get_serializer(instance).data)
+
+    #名前のリストをまとめてidに変換する。存在しない名前は作成する
+    @action(detail=False, methods=['post'])
+    def upsert(self, request):
+        serializer = UpsertNamesSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = upsert_names(self.queryset.model, self.name_field, serializer.validated_data['names'])
+        return Response(ids)
+
+
 #segmentViewSetでは、CRUDのすべての機能を使いたいため、modelのviewセットを使用
 #二行書くだけでCRUDの機能を使うことができる
-class SegmentViewSet(viewsets.ModelViewSet):
+class SegmentViewSet(NaturalKeyMixin, NestedVehiclesMixin, viewsets.ModelViewSet):
     #modelviewsetを使う場合は、querysetにオブジェクトの一覧を格納する必要がある
-    queryset = Segment.objects.all()
+    #vehicle_countは1回のGROUP BYでまとめて数える
+    queryset = Segment.objects.annotate(vehicle_count=Count('vehicle'))
     serializer_class = SegmentSerializer
+    query_budgets = {'list': 2, 'retrieve': 2, 'vehicles': 3, 'by_name': 2, 'upsert': 3}
+    vehicle_filter = 'segment'
+    name_field = 'segment_name'
 
 
-class BrandViewSet(viewsets.ModelViewSet):
-    queryset = Brand.objects.all()
+class BrandViewSet(NaturalKeyMixin, NestedVehiclesMixin, viewsets.ModelViewSet):
+    queryset = Brand.objects.annotate(vehicle_count=Count('vehicle'))
     serializer_class = BrandSerializer
+    query_budgets = {'list': 2, 'retrieve': 2, 'vehicles': 3, 'by_name': 2, 'upsert': 3}
+    vehicle_filter = 'brand'
+    name_field = 'brand_name'
 
 
 class VehicleViewSet(viewsets.ModelViewSet):
-    queryset = Vehicle.objects.all()
+    #segment_name、brand_nameを返すため、segmentとbrandをJOINで一緒に取得する(N+1を防ぐ)
+    queryset = Vehicle.objects.select_related('segment', 'brand')
     serializer_class = VehicleSerializer
+    query_budgets = {'list': 2, 'retrieve': 2, 'mine': 2}
+    #書き込みは登録した本人のみ
+    permission_classes = (permissions.IsAuthenticated, IsOwnerOrReadOnly)
+
+    #?include_archived=1のときだけ、アーカイブ済みのvehicleも返す
+    def include_archived(self):
+        return self.request.query_params.get('include_archived') in ('1', 'true')
+
+    #?include_archived=1の一覧はアーカイブ(一番大きいテーブル)も含むので、全件ではなくidのキーセットページネーションで返す
+    #?after=<前のページの最後のid>、?page_size=(件数の上限は/api/vehicles/mine/と同じ)
+    def archived_page(self):
+        page = {}
+        for param, default in (('after', 0), ('page_size', VehicleCursorPagination.page_size)):
+            try:
+                page[param] = int(self.request.query_params.get(param, default))
+            except ValueError:
+                raise ValidationError({param: ['A valid integer is required.']})
+        page['page_size'] = max(1, min(page['page_size'], VehicleCursorPagination.max_page_size))
+        return page
+
+    #一覧の結果は、クエリパラメータとvehicle、segment、brandのテーブルのバージョンをキーにしてキャッシュする
+    #(segment_name、brand_nameも返しているので、segment、brandの変更でも作り直す)
+    def list(self, request, *args, **kwargs):
+        #クエリパラメータのバリデーションはリクエストのスレッドで行う
+        filters = self.price_filters()
+        page = self.archived_page() if self.include_archived() else None
+
+        def build():
+            return self.build_list(filters, page)
+
+        if not result_cache.get_setting('ENABLED'):
+            data = build()
+        else:
+            params = tuple(sorted((name, tuple(values)) for name, values in request.query_params.lists()))
+            key = (
+                params, table_version(Vehicle), table_version(ArchivedVehicle),
+                table_version(Segment), table_version(Brand),
+            )
+            data = vehicle_list_cache.get_or_build(key, build)
+        if page is not None:
+            #次のページのURLはリクエストごとに作る(キャッシュにはidだけ入れる)
+            next_url = None
+            if data['next_after'] is not None:
+                next_url = replace_query_param(request.build_absolute_uri(), 'after', data['next_after'])
+            data = {'next': next_url, 'results': data['results']}
+        return Response(data)
+
+    #一覧のデータを作る
+    #キャッシュの作り直しはリクエストが終わった後に別スレッドで行われることもあるので、requestやviewのインスタンスは使わない
+    @classmethod
+    def build_list(cls, filters, page=None):
+        if page is None:
+            return VehicleSerializer(cls.queryset.filter(**filters), many=True).data
+        #アーカイブは別のテーブルなので、両方のidの範囲スキャンをUNION ALLでつなぎ、idでの並べ替えと件数の制限はDBで行う
+        #(次のページがあるかを知るために1件多く取る)
+        querysets = [
+            model.objects.filter(id__gt=page['after'], **filters).values_list(*ARCHIVED_LIST_FIELDS)
+            for model in (Vehicle, ArchivedVehicle)
+        ]
+        rows = querysets[0].union(querysets[1], all=True).order_by('id')[:page['page_size'] + 1]
+        vehicles = [vehicle_from_row(row) for row in rows]
+        next_after = vehicles[page['page_size'] - 1].id if len(vehicles) > page['page_size'] else None
+        return {'next_after': next_after, 'results': VehicleSerializer(vehicles[:page['page_size']], many=True).data}
+
+    #?min_price=、?max_price=での絞り込み(price_centsのインデックスでの範囲検索になる)
+    def price_filters(self):
+        filters = {}
+        for param, lookup in (('min_price', 'price_cents__gte'), ('max_price', 'price_cents__lte')):
+            value = self.request.query_params.get(param)
+            if value is None:
+                continue
+            try:
+                filters[lookup] = CentsPriceField().to_internal_value(value)
+            except ValidationError as exc:
+                raise ValidationError({param: exc.detail})
+        return filters
+
+    def filter_queryset(self, queryset):
+        return super().filter_queryset(queryset).filter(**self.price_filters())
+
+    #?include_archived=1のGETでは、見つからなければアーカイブからも探す(更新・削除はできない)
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.action != 'retrieve' or not self.include_archived():
+                raise
+        return get_object_or_404(ArchivedVehicle.objects.select_related('segment', 'brand'), pk=self.kwargs['pk'])
+
+    #一覧のキャッシュのヒット数などを返す(管理者のみ)
+    @action(detail=False, methods=['get'], url_path='cache-metrics', permission_classes=[permissions.IsAdminUser])
+    def cache_metrics(self, request):
+        return Response(vehicle_list_cache.metrics)
+
+    #ログインしているユーザーが登録したvehicleだけを返す(/api/vehicles/mine/)
+    #(user, id)のインデックスとキーセットページネーションで、件数が増えても速度が落ちないようにしている
+    @action(detail=False, methods=['get'], pagination_class=VehicleCursorPagination)
+    def mine(self, request):
+        queryset = self.get_queryset().filter(user=request.user)
+        page = self.paginate_queryset(queryset)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    #価格の分位点、release_year別の推移、brand・segment別の分布(/api/vehicles/stats/)
+    #全件をnumpyの配列として取得して計算し、結果はテーブルのバージョンごとにキャッシュする
+    @action(detail=False, methods=['get'])
+    def stats(self, request):
+        return Response(get_price_stats())
 
     #新しくvehicleのオブジェクトを作る際にログインしているユーザーの情報を割り当てる
+    def perform_create(self, serializer):
+        if group_commit.is_enabled(self.request._request):
+            #ほかのリクエストのINSERTとまとめて1回のcommitで書き込む(WSGIのみ)
+            vehicle = Vehicle(user=self.request.user, **serializer.validated_data)
+            try:
+                serializer.instance = vehicle_buffer.submit(vehicle)
+            except IntegrityError as exc:
+                serializer.raise_for_missing_references(exc)
+            return
+        serializer.save(user=self.request.user)
+
+
+#バックグラウンドジョブの登録と状態の確認(/api/jobs/)
+#登録されたジョブはmanage.py run_workersのworkerが実行する
+class JobViewSet(mixins.CreateModelMixin,
+                 mixins.RetrieveModelMixin,
+                 mixins.ListModelMixin,
+                 viewsets.GenericViewSet):
+    queryset = Job.objects.all()
+    serializer_class = JobSerializer
+    query_budgets = {'list': 2, 'retrieve': 2, 'download': 2}
+
+    #自分が登録したジョブだけを扱う
+    def get_queryset(self):
+        return super().get_queryset().filter(user=self.request.user).order_by('-id')
+
     def perform_create(self, serializer):
         serializer.save(user=self.request.user)
 
+    #POST /api/jobs/{id}/cancel/
+    @action(detail=True, methods=['post'])
+    def cancel(self, request, pk=None):
+        job = jobs.cancel_job(self.get_object())
+        return Response(self.get_serializer(job).data)
 
+    #GET /api/jobs/{id}/download/
+    #export_vehiclesのジョブが書き出したCSVを返す
+    @action(detail=True, methods=['get'])
+    def download(self, request, pk=None):
+        job = self.get_object()
+        if job.kind != 'export_vehicles' or job.status != Job.SUCCEEDED:
+            raise NotFound('This job has no file to download.')
+        path = jobs.export_path(job)
+        if not os.path.exists(path):
+            raise NotFound('The exported file is no longer available.')
+        return FileResponse(open(path, 'rb'), as_attachment=True, filename=os.path.basename(path),
+                            content_type='text/csv')
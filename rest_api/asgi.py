@@ -8,9 +8,30 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/asgi/
 """
 
 import os
+import time
+
+started = time.perf_counter()
 
 from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rest_api.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from api.events import event_stream
+from rest_api import warmup
+
+EVENTS_PATH = '/api/events/'
+
+
+#/api/events/はdjangoのviewを通さず、SSEのストリームを直接返す
+#(django 3.1のStreamingHttpResponseは非同期のイテレータに対応していないため)
+async def application(scope, receive, send):
+    if scope['type'] == 'http' and scope['path'] == EVENTS_PATH:
+        return await event_stream(scope, receive, send)
+    return await django_application(scope, receive, send)
+
+
+#ASGIではsyncのviewが別スレッドで動くため、ここで張ったDB接続はリクエストでは使われない
+#DB接続のwarm-upはしない
+application = warmup.prepare(application, started, connect=False, asgi=True)
@@ -0,0 +1,19 @@
+#本番用のgunicorn設定
+#gunicorn -c rest_api/gunicorn.conf.py rest_api.wsgi:application
+bind = '0.0.0.0:8000'
+workers = 4
+#masterでアプリを読み込み、warm-upまで済ませてからforkする
+#workerはwarm済みのメモリを引き継ぐので、起動直後のリクエストが遅くならない
+preload_app = True
+
+
+def pre_fork(server, worker):
+    from django.db import connections
+    #DB接続はプロセス間で共有できないので、fork前にmasterの接続を閉じる
+    connections.close_all()
+
+
+def post_fork(server, worker):
+    from rest_api import warmup
+    #worker側で改めてDB接続を張っておく
+    warmup.warm_connections()
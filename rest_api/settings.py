@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/3.1/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -43,7 +44,7 @@ INSTALLED_APPS = [
     'api.apps.ApiConfig',
 ]
 
-MIDDLEWARE = [
+FULL_MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -52,8 +53,33 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.budgets.QueryBudgetMiddleware',
 ]
 
+#API向けの軽量なmiddleware構成
+#/api/へのリクエストではsession、csrf、messages、clickjackingの処理を飛ばす(/admin/は従来通り)
+API_MIDDLEWARE = [
+    'corsheaders.middleware.CorsMiddleware',
+    'django.middleware.security.SecurityMiddleware',
+    'api.middleware.ApiSkipSessionMiddleware',
+    'django.middleware.common.CommonMiddleware',
+    'api.middleware.ApiSkipCsrfViewMiddleware',
+    'api.middleware.ApiSkipAuthenticationMiddleware',
+    'api.middleware.ApiSkipMessageMiddleware',
+    'api.middleware.ApiSkipXFrameOptionsMiddleware',
+    'api.budgets.QueryBudgetMiddleware',
+]
+
+API_PATH_PREFIX = '/api/'
+
+#DJANGO_MIDDLEWARE_PROFILE=apiで軽量な構成に切り替える(デフォルトはfull)
+MIDDLEWARE_PROFILE = os.environ.get('DJANGO_MIDDLEWARE_PROFILE', 'full')
+#viewごとのクエリ数の上限(query_budgets)を実行時にチェックする
+#'log'で超えたときにSQLとstackをログに出し、'raise'でエラーにする。未設定なら何もしない
+QUERY_BUDGET_MODE = os.environ.get('DJANGO_QUERY_BUDGET_MODE')
+
+MIDDLEWARE = API_MIDDLEWARE if MIDDLEWARE_PROFILE == 'api' else FULL_MIDDLEWARE
+
 CORS_ORIGIN_WHITELIST = [
     "http://localhost:3000"
 ]
@@ -88,6 +114,49 @@ REST_FRAMEWORK = {
     ]
 }
 
+#POST /api/vehicles/のgroup commit(api/group_commit.py)
+#スレッドで並行に処理するWSGIのworker(gunicorn --threadsなど)向け。ASGI(asgi.py)では有効にしても使われない
+#同時に来たINSERTをMAX_DELAY_MSかMAX_ROWS件までまとめて、1回のcommitで書き込む
+VEHICLE_GROUP_COMMIT = {
+    'ENABLED': os.environ.get('DJANGO_VEHICLE_GROUP_COMMIT') == '1',
+    'MAX_DELAY_MS': 5,
+    'MAX_ROWS': 100,
+}
+
+#GET /api/vehicles/の結果のキャッシュ(api/result_cache.py)
+VEHICLE_LIST_CACHE = {
+    'ENABLED': True,
+    'TTL_SECONDS': 30,
+    'STALE_SECONDS': 60,
+    'MAX_ENTRIES': 256,
+    'LOCK_SECONDS': 10,
+}
+
+#古いvehicleのアーカイブ(manage.py archive_vehicles)
+#release_yearが「今年 - CUTOFF_YEARS」より前のものを、BATCH_SIZE件ずつapi_archivedvehicleへ移す
+VEHICLE_ARCHIVE = {
+    'CUTOFF_YEARS': 10,
+    'BATCH_SIZE': 1000,
+}
+
+#バックグラウンドジョブ(api/jobs.py、manage.py run_workers)
+JOBS = {
+    'PROCESSES': 2,
+    'POLL_SECONDS': 1,
+    'HEARTBEAT_SECONDS': 30,
+    'HEARTBEAT_TIMEOUT_SECONDS': 300,
+    'MAX_ATTEMPTS': 3,
+    'EXPORT_DIR': BASE_DIR / 'exports',
+    'BATCH_SIZE': 1000,
+}
+
+#Server-Sent Eventsでの変更通知(api/events.py、ASGIのみ)
+EVENT_STREAM = {
+    'BUFFER_SIZE': 100,
+    'HISTORY_SIZE': 1000,
+    'HEARTBEAT_SECONDS': 15,
+}
+
 # Database
 # https://docs.djangoproject.com/en/3.1/ref/settings/#databases
 
@@ -99,6 +168,24 @@ DATABASES = {
 }
 
 
+#テーブルのバージョン(api/cache.py)や集計・一覧のキャッシュを、全プロセスで共有するキャッシュ
+#LocMemCache(デフォルト)はプロセスごとなので、gunicornのworkerやrun_workersのプロセスの間で無効化が伝わらない
+#デフォルトは同じホストのプロセスで共有できるファイルのキャッシュ。複数のホストで動かす場合はmemcachedなどに変えること
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('DJANGO_CACHE_BACKEND', 'django.core.cache.backends.filebased.FileBasedCache'),
+        'LOCATION': os.environ.get('DJANGO_CACHE_LOCATION', str(BASE_DIR / 'cache')),
+        'OPTIONS': {
+            #上限を超えると古いものから消されるので、バージョンのキーが消えにくいよう大きめにする
+            'MAX_ENTRIES': 10000,
+        },
+    }
+}
+
+#テストではプロセス内のキャッシュを使う(rest_api/test_runner.py)
+TEST_RUNNER = 'rest_api.test_runner.TestRunner'
+
+
 # Password validation
 # https://docs.djangoproject.com/en/3.1/ref/settings/#auth-password-validators
 
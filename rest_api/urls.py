@@ -1,8 +1,11 @@
 from django.contrib import admin
 from django.urls import path, include
+from rest_api import warmup
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     #api/というurlにアクセスがあった際は、api.urlsを参照するように設定
     path('api/', include('api.urls')),
+    #warm-upが終わったかどうかを返すreadinessチェック(認証なし)
+    path('ready/', warmup.readiness, name='ready'),
 ]
@@ -0,0 +1,106 @@
+#workerのwarm-up
+#wsgi.py/asgi.pyでアプリを読み込んだ直後にprepare()を呼び、urlのresolver、serializer、DB接続を最初のリクエストの前に準備する
+#readinessは準備が終わるまで503を返すので、ロードバランサーは準備中のworkerにリクエストを送らない
+import logging
+import time
+
+from django.db import connections
+from django.http import JsonResponse
+from django.urls import get_resolver, resolve, Resolver404
+
+logger = logging.getLogger(__name__)
+
+#warm-upの状態と計測値(秒)
+#gunicornのpreloadではmasterで作ったものがforkでworkerにそのままコピーされる
+state = {
+    'ready': False,
+    'import_seconds': None,
+    'warmup_seconds': None,
+    'first_request_seconds': None,
+}
+_started = None
+
+
+def warm_routes():
+    #reverse用の辞書と正規表現をここで作っておく
+    get_resolver().reverse_dict
+    from api.urls import router
+    #routerに登録したurlを一度resolveして、include先のresolverもコンパイルさせる
+    paths = ['/api/profile/', '/api/auth/']
+    for prefix, viewset, basename in router.registry:
+        paths += ['/api/%s/' % prefix, '/api/%s/1/' % prefix]
+    for path in paths:
+        try:
+            resolve(path)
+        except Resolver404:
+            pass
+
+
+def warm_serializers():
+    from api.urls import router
+    #serializerのfieldsを一度組み立てることで、modelの_metaやリレーション情報をキャッシュさせる
+    for prefix, viewset, basename in router.registry:
+        viewset.serializer_class().fields
+
+
+def warm_connections():
+    for conn in connections.all():
+        conn.ensure_connection()
+
+
+def warm_up(connect=True):
+    began = time.perf_counter()
+    warm_routes()
+    warm_serializers()
+    if connect:
+        warm_connections()
+    state['warmup_seconds'] = time.perf_counter() - began
+    state['ready'] = True
+    logger.info('warm-up finished in %.3fs', state['warmup_seconds'])
+
+
+#プロセスの起動から最初のリクエストまでの時間を記録するWSGIのwrapper
+class FirstRequestTimer:
+
+    def __init__(self, application):
+        self.application = application
+
+    def __call__(self, environ, start_response):
+        if state['first_request_seconds'] is None:
+            _record_first_request()
+        return self.application(environ, start_response)
+
+
+#FirstRequestTimerのASGI版
+class AsyncFirstRequestTimer:
+
+    def __init__(self, application):
+        self.application = application
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http' and state['first_request_seconds'] is None:
+            _record_first_request()
+        return await self.application(scope, receive, send)
+
+
+def _record_first_request():
+    state['first_request_seconds'] = time.perf_counter() - _started
+    logger.info('first request %.3fs after start', state['first_request_seconds'])
+
+
+def prepare(application, started, connect=True, asgi=False):
+    #startedはwsgi.py/asgi.pyの先頭(djangoのimport前)で取った時刻
+    global _started
+    _started = started
+    state['import_seconds'] = time.perf_counter() - started
+    logger.info('application loaded in %.3fs', state['import_seconds'])
+    warm_up(connect=connect)
+    if asgi:
+        return AsyncFirstRequestTimer(application)
+    return FirstRequestTimer(application)
+
+
+#ロードバランサーのヘルスチェック用。warm-upが終わるまでは503を返す
+def readiness(request):
+    status = 200 if state['ready'] else 503
+    return JsonResponse(state, status=status)
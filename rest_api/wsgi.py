@@ -8,9 +8,17 @@ https://docs.djangoproject.com/en/3.1/howto/deployment/wsgi/
 """
 
 import os
+import time
+
+#import時間を計測するため、djangoを読み込む前に時刻を取っておく
+started = time.perf_counter()
 
 from django.core.wsgi import get_wsgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'rest_api.settings')
 
 application = get_wsgi_application()
+
+from rest_api import warmup
+
+application = warmup.prepare(application, started)